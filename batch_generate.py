@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from generate_chord_prog import DEFAULT_BPM, generate_with_midi, load_data, open_result_cache
+from nlp.matcher import EMOTIONS, preload_lexicon, prompts_to_emotion_biases
+from section_chord_prog_gen import DEFAULT_BIAS_STEP, DEFAULT_DISTRIBUTION_CACHE_BYTES, DistributionLRU
+
+DEFAULT_CHUNK_SIZE = 256
+# Chunks submitted ahead per worker; bounds how many finished results wait in memory.
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+_state: dict = {}
+
+
+def _load_worker_state(
+    data_dir: Path,
+    bpm: int,
+    cache_dir: Path | None = None,
+    bias_step: float = DEFAULT_BIAS_STEP,
+    distribution_cache_bytes: int = DEFAULT_DISTRIBUTION_CACHE_BYTES,
+) -> None:
+    # With fork the parent's loaded state is inherited; spawned workers load their own copy.
+    if _state.get("data_dir") != data_dir:
+        pattern_index, key_samplers = load_data(data_dir)
+        preload_lexicon()
+        _state.update(data_dir=data_dir, pattern_index=pattern_index, key_samplers=key_samplers)
+    _state["bpm"] = bpm
+    _state["results"] = open_result_cache(data_dir, cache_dir) if cache_dir is not None else None
+    _state["distributions"] = DistributionLRU(distribution_cache_bytes, bias_step)
+
+
+def _generate_chunk(prompt: str, items: list[tuple[str, int]]) -> list[dict]:
+    # Every item in a chunk shares the prompt, so its bias and candidate weights are computed once.
+    distributions: DistributionLRU = _state["distributions"]
+    emotion_bias = distributions.quantize(dict(zip(EMOTIONS, prompts_to_emotion_biases([prompt])[0])))
+    results = []
+    for name, seed in items:
+        progression, midi = generate_with_midi(
+            emotion_bias,
+            _state["pattern_index"],
+            _state["key_samplers"],
+            seed,
+            _state["bpm"],
+            _state["results"],
+            distributions,
+        )
+        results.append({
+            "name": name,
+            "prompt": prompt,
+            "seed": seed,
+            "key_id": progression["key_id"],
+            "mode": progression["mode"],
+            "sections": progression["sections"],
+            "used_fallback": progression["used_fallback"],
+            "midi": midi,
+        })
+    return results
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", value).strip("._") or "item"
+
+
+def read_jobs(path: Path, base_seed: int) -> dict[str, list[tuple[str, int]]]:
+    # One JSON object per line: {"prompt": ..., "count": 1, "seed": ..., "id": ...}. Items are
+    # grouped by prompt; without a seed, a line's seeds derive from --seed and its line number.
+    jobs: dict[str, list[tuple[str, int]]] = {}
+    name_lines: dict[str, int] = {}
+    with path.open("r", encoding="utf-8") as handle:
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError:
+                raise SystemExit(f"{path}:{line_number}: not valid JSON") from None
+            prompt = job.get("prompt") if isinstance(job, dict) else None
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise SystemExit(f"{path}:{line_number}: expected a non-empty string 'prompt'")
+            count = job.get("count", 1)
+            if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+                raise SystemExit(f"{path}:{line_number}: 'count' must be a positive integer")
+            seed = job.get("seed")
+            if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+                raise SystemExit(f"{path}:{line_number}: 'seed' must be an integer")
+            if seed is None:
+                seed = base_seed * 1_000_003 + line_number * 100_003
+            stem = _safe_name(str(job.get("id", f"{line_number:06d}")))
+            names = [f"{stem}_{index:04d}.mid" if count > 1 else f"{stem}.mid" for index in range(count)]
+            for name in names:
+                if name in name_lines:
+                    raise SystemExit(f"{path}:{line_number}: id gives {name}, already used on line {name_lines[name]}")
+                name_lines[name] = line_number
+            jobs.setdefault(prompt.strip(), []).extend((name, seed + index) for index, name in enumerate(names))
+    return jobs
+
+
+def _chunks(jobs: dict[str, list[tuple[str, int]]], chunk_size: int) -> Iterator[tuple[str, list[tuple[str, int]]]]:
+    for prompt, items in jobs.items():
+        for start in range(0, len(items), chunk_size):
+            yield prompt, items[start:start + chunk_size]
+
+
+class _DirectoryWriter:
+    def __init__(self, out_dir: Path) -> None:
+        self.out_dir = out_dir
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = (out_dir / "manifest.jsonl").open("w", encoding="utf-8")
+
+    def write(self, name: str, midi: bytes, record: dict) -> None:
+        (self.out_dir / name).write_bytes(midi)
+        self.manifest.write(json.dumps(record) + "\n")
+
+    def close(self) -> None:
+        self.manifest.close()
+
+
+class _ArchiveWriter:
+    def __init__(self, archive_path: Path) -> None:
+        self.archive = zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.manifest: list[str] = []
+
+    def write(self, name: str, midi: bytes, record: dict) -> None:
+        self.archive.writestr(name, midi)
+        self.manifest.append(json.dumps(record))
+
+    def close(self) -> None:
+        self.archive.writestr("manifest.jsonl", "\n".join(self.manifest) + "\n")
+        self.archive.close()
+
+
+def generate_batch(
+    jobs: dict[str, list[tuple[str, int]]],
+    writer: _DirectoryWriter | _ArchiveWriter,
+    data_dir: Path,
+    workers: int,
+    bpm: int = DEFAULT_BPM,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    cache_dir: Path | None = None,
+    bias_step: float = DEFAULT_BIAS_STEP,
+    distribution_cache_bytes: int = DEFAULT_DISTRIBUTION_CACHE_BYTES,
+) -> int:
+    worker_options = (data_dir, bpm, cache_dir, bias_step, distribution_cache_bytes)
+    _load_worker_state(*worker_options)
+    chunks = _chunks(jobs, chunk_size)
+    written = 0
+    if workers <= 1:
+        batches = (_generate_chunk(prompt, items) for prompt, items in chunks)
+        for results in batches:
+            written += _write_results(writer, results)
+        return written
+
+    # Chunks go out through a bounded window and are written in submission order.
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker_state, initargs=worker_options) as executor:
+        in_flight: deque[Future] = deque()
+        for prompt, items in chunks:
+            in_flight.append(executor.submit(_generate_chunk, prompt, items))
+            if len(in_flight) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                written += _write_results(writer, in_flight.popleft().result())
+        while in_flight:
+            written += _write_results(writer, in_flight.popleft().result())
+    return written
+
+
+def _write_results(writer: _DirectoryWriter | _ArchiveWriter, results: list[dict]) -> int:
+    for result in results:
+        midi = result.pop("midi")
+        writer.write(result["name"], midi, result)
+    return len(results)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate MIDI progressions for every prompt in a JSONL file.")
+    parser.add_argument("jobs", type=Path, help='JSONL with one {"prompt", "count", "seed", "id"} object per line')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--out-dir", type=Path, help="write one .mid per item plus manifest.jsonl here")
+    output.add_argument("--archive", type=Path, help="write every .mid plus manifest.jsonl into one zip file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=Path("."),
+        help="directory holding the pattern store or summary, key_profile.json and the voicing table (default: cwd)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="base seed for lines without their own (default: 0)")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="reuse results of earlier runs stored here")
+    parser.add_argument(
+        "--bias-step",
+        type=float,
+        default=DEFAULT_BIAS_STEP,
+        help=f"round prompt biases to this step, as the server does, 0 to keep them exact (default: {DEFAULT_BIAS_STEP})",
+    )
+    parser.add_argument(
+        "--distribution-cache-mb",
+        type=float,
+        default=DEFAULT_DISTRIBUTION_CACHE_BYTES / (1024 * 1024),
+        help=f"memory bound of each worker's distribution cache (default: {DEFAULT_DISTRIBUTION_CACHE_BYTES // (1024 * 1024)})",
+    )
+    parser.add_argument("--bpm", type=int, default=DEFAULT_BPM, help=f"tempo of written MIDI (default: {DEFAULT_BPM})")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"items of one prompt sent to a worker at a time (default: {DEFAULT_CHUNK_SIZE})",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    jobs = read_jobs(args.jobs, args.seed)
+    writer = _DirectoryWriter(args.out_dir) if args.out_dir else _ArchiveWriter(args.archive)
+    started = time.perf_counter()
+    try:
+        written = generate_batch(
+            jobs,
+            writer,
+            args.data_dir,
+            args.workers,
+            args.bpm,
+            max(1, args.chunk_size),
+            args.cache_dir,
+            args.bias_step,
+            int(args.distribution_cache_mb * 1024 * 1024),
+        )
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+    destination = args.out_dir or args.archive
+    print(
+        f"Wrote {written} progressions for {len(jobs)} distinct prompts to {destination} "
+        f"in {elapsed:.2f}s ({written / elapsed if elapsed else 0:.1f} items/s)",
+        file=sys.stderr,
+    )
+    if args.workers <= 1:
+        print(f"Distribution cache: {_state['distributions'].stats()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from itertools import cycle
+from urllib.parse import urlsplit
+
+DEFAULT_PROMPTS = (
+    "calm nostalgic evening",
+    "dark tense night drive",
+    "happy triumphant morning",
+    "very wistful rainy day",
+    "slightly dark but hopeful",
+)
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[position]
+
+
+def _client(
+    host: str,
+    port: int,
+    prompts: list[str],
+    include_midi: bool,
+    deadline: float,
+    remaining: list[int],
+    lock: threading.Lock,
+    latencies: list[float],
+    errors: list[str],
+) -> None:
+    # One keep-alive connection per client thread; requests are sent back to back.
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    prompt_cycle = cycle(prompts)
+    while time.perf_counter() < deadline:
+        with lock:
+            if remaining[0] == 0:
+                break
+            remaining[0] -= 1
+            prompt = next(prompt_cycle)
+        body = json.dumps({"prompt": prompt, "midi": include_midi})
+        started = time.perf_counter()
+        try:
+            connection.request("POST", "/generate", body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            errors.append(repr(exc))
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        elapsed = time.perf_counter() - started
+        if response.status != 200:
+            errors.append(f"HTTP {response.status}: {payload[:200]!r}")
+            continue
+        latencies.append(elapsed)
+    connection.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load-test generation_server.py and report throughput and latency.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="server base URL (default: http://127.0.0.1:8765)")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel keep-alive connections (default: 8)")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests to send (default: 2000)")
+    parser.add_argument("--duration", type=float, default=60.0, help="stop after this many seconds (default: 60)")
+    parser.add_argument("--no-midi", action="store_true", help="ask for sections only, without MIDI bytes")
+    parser.add_argument("--prompts", type=argparse.FileType("r"), default=None, help="file with one prompt per line")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    url = urlsplit(args.url)
+    prompts = [line.strip() for line in args.prompts if line.strip()] if args.prompts else list(DEFAULT_PROMPTS)
+
+    latencies: list[float] = []
+    errors: list[str] = []
+    remaining = [args.requests]
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(
+            target=_client,
+            args=(url.hostname, url.port or 80, prompts[i:] + prompts[:i], not args.no_midi, deadline, remaining, lock, latencies, errors),
+        )
+        for i in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"requests: {len(latencies)} ok, {len(errors)} failed in {elapsed:.2f}s with concurrency {args.concurrency}")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    if latencies:
+        print(
+            "latency ms: "
+            f"mean {statistics.fmean(latencies) * 1000:.2f}  "
+            f"p50 {_percentile(latencies, 0.50) * 1000:.2f}  "
+            f"p90 {_percentile(latencies, 0.90) * 1000:.2f}  "
+            f"p99 {_percentile(latencies, 0.99) * 1000:.2f}  "
+            f"max {latencies[-1] * 1000:.2f}"
+        )
+    for error in errors[:5]:
+        print(f"error: {error}")
+
+
+if __name__ == "__main__":
+    main()
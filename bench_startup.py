@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent
+STAGES = ("import", "load", "first_prompt", "total")
+
+# Each run is a fresh interpreter, so every stage is a true cold start. "uncached" parses the
+# JSON summary and rebuilds the lexicon trie; "cached" maps the binary pattern store and
+# unpickles the compiled lexicon, as load_data and nlp.matcher do by default.
+_CHILD = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+import generate_chord_prog as g
+from nlp import matcher
+imported = time.perf_counter()
+
+if sys.argv[1] == "uncached":
+    from pattern_index import PatternIndex
+    from section_chord_prog_gen import compile_sections
+    with open("progression_pattern_summary.json", encoding="utf-8") as handle:
+        pattern_index = PatternIndex.from_summaries(json.load(handle))
+    for mode in sorted(set(pattern_index.modes)):
+        compile_sections(pattern_index.for_mode(mode))
+    with open("key_profile.json", encoding="utf-8") as handle:
+        key_samplers = g.build_key_samplers(json.load(handle))
+    matcher._compiled_lexicon = matcher.load_compiled_lexicon(use_cache=False)
+else:
+    pattern_index, key_samplers = g.load_data()
+    matcher._get_compiled_lexicon()
+loaded = time.perf_counter()
+
+class SilentPlayer:
+    def play(self, midi_path, replace=False):
+        return False
+
+with contextlib.redirect_stdout(io.StringIO()):
+    g.run_once(sys.argv[2], pattern_index, key_samplers, g.Path(sys.argv[3]), SilentPlayer())
+finished = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "load": loaded - imported,
+    "first_prompt": finished - loaded,
+    "total": finished - start,
+}))
+"""
+
+
+def run_child(variant: str, prompt: str, data_dir: Path, midi_path: Path) -> dict[str, float]:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")])))
+    completed = subprocess.run(
+        [sys.executable, "-c", _CHILD, variant, prompt, str(midi_path)],
+        cwd=data_dir,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure cold-start time of generate_chord_prog.")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per variant (default: 10)")
+    parser.add_argument("--prompt", default="calm nostalgic evening", help="prompt used for the first generation")
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=Path.cwd(),
+        help="directory holding progression_pattern_summary.json and key_profile.json (default: cwd)",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if not (args.data_dir / "progression_pattern_store.bin").exists():
+        print("progression_pattern_store.bin is missing; run progression_pattern_collection.py --store-only first")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        midi_path = Path(tmp) / "bench.mid"
+        # Warm-up run writes the compiled lexicon cache and pulls files into the page cache.
+        run_child("cached", args.prompt, args.data_dir, midi_path)
+        results: dict[str, list[dict[str, float]]] = {"uncached": [], "cached": []}
+        for _ in range(args.runs):
+            for variant, timings in results.items():
+                timings.append(run_child(variant, args.prompt, args.data_dir, midi_path))
+
+    print(f"{'variant':<10}" + "".join(f"{stage:>14}" for stage in STAGES) + "   (median ms)")
+    for variant, timings in results.items():
+        medians = [statistics.median(timing[stage] for timing in timings) * 1000 for stage in STAGES]
+        print(f"{variant:<10}" + "".join(f"{median:>14.1f}" for median in medians))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,20 @@
+import hashlib
+import sys
+from collections.abc import Iterable
 from dataclasses import dataclass
 from typing import Literal, TypedDict
 
 
+EMOTION_IDS = (
+    "suspenseful_tense",
+    "calm_meditative",
+    "wistful_longing",
+    "motivational_triumphant",
+    "nostalgic_sentimental",
+    "dark_brooding",
+    "happy_uplifting",
+)
+
 @dataclass(frozen=True)
 class EmotionScore(TypedDict):
     suspenseful_tense: float
@@ -30,3 +43,157 @@ class KeyProfile(TypedDict):
     mode:Literal['major', 'minor']
     display_name:str
     weight : float
+
+
+@dataclass(frozen=True)
+class SectionProgression(TypedDict):
+    section: str
+    chords: list[str]
+
+
+@dataclass(frozen=True)
+class StreamedSection(TypedDict):
+    index: int
+    section: str
+    chords: list[str]
+    mode: Literal['major', 'minor']
+    key_id: str
+    tonic: str
+    used_fallback: bool
+    midi: bytes | None
+
+
+@dataclass(frozen=True)
+class GeneratedProgression(TypedDict):
+    emotion_bias: EmotionScore
+    mode: Literal['major', 'minor']
+    key_id: str
+    tonic: str
+    sections: list[SectionProgression]
+    used_fallback: bool
+
+
+class SymbolTable:
+    # Interns chord symbols as small integer codes shared by every loaded pattern.
+    __slots__ = ("names", "_codes")
+
+    def __init__(self, names: tuple[str, ...] = ()) -> None:
+        self.names: list[str] = []
+        self._codes: dict[str, int] = {}
+        for name in names:
+            self.code(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(sys.intern(name))
+        return code
+
+    def codes(self, names: Iterable[str]) -> tuple[int, ...]:
+        return tuple(self.code(name) for name in names)
+
+    def decode(self, codes: Iterable[int]) -> list[str]:
+        return [self.names[code] for code in codes]
+
+
+def roman_sequence_id(roman_sequence: Iterable[str]) -> int:
+    # Signed 64-bit hash of the numerals. Unlike symbol codes or row positions it is the same
+    # in every process and for every pattern source, so it can be stored and compared directly.
+    digest = hashlib.blake2b(" ".join(roman_sequence).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+NUMERALS = SymbolTable()
+FUNCTIONS = SymbolTable(("T", "PD", "D"))
+TONIC_FUNCTION = FUNCTIONS.code("T")
+DOMINANT_FUNCTION = FUNCTIONS.code("D")
+
+
+class PatternRecord:
+    # Runtime form of a ProgressionSummary: coded symbols and an emotion vector in EMOTION_IDS order.
+    __slots__ = ("roman_codes", "function_codes", "mode", "count", "base_weight", "emotion_vector")
+
+    def __init__(
+        self,
+        roman_codes: tuple[int, ...],
+        function_codes: tuple[int, ...],
+        mode: str,
+        count: int,
+        base_weight: float,
+        emotion_vector: tuple[float, ...],
+    ) -> None:
+        self.roman_codes = roman_codes
+        self.function_codes = function_codes
+        self.mode = mode
+        self.count = count
+        self.base_weight = base_weight
+        self.emotion_vector = emotion_vector
+
+    @classmethod
+    def from_summary(cls, summary: ProgressionSummary) -> "PatternRecord":
+        return cls(
+            NUMERALS.codes(summary["roman_sequence"]),
+            FUNCTIONS.codes(summary["function_sequence"]),
+            sys.intern(summary["mode"]),
+            summary["count"],
+            summary["base_weight"],
+            tuple(float(summary["emotion_scores"].get(emotion_id, 0.0)) for emotion_id in EMOTION_IDS),
+        )
+
+    @property
+    def roman_sequence(self) -> list[str]:
+        return NUMERALS.decode(self.roman_codes)
+
+    @property
+    def function_sequence(self) -> list[str]:
+        return FUNCTIONS.decode(self.function_codes)
+
+    @property
+    def sequence_id(self) -> int:
+        return roman_sequence_id(self.roman_sequence)
+
+    def to_summary(self) -> ProgressionSummary:
+        return {
+            "roman_sequence": self.roman_sequence,
+            "mode": self.mode,
+            "function_sequence": self.function_sequence,
+            "count": self.count,
+            "base_weight": self.base_weight,
+            "emotion_scores": dict(zip(EMOTION_IDS, self.emotion_vector)),
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PatternRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"PatternRecord({self.mode}, {self.roman_sequence}, count={self.count})"
+
+
+class KeyRecord:
+    __slots__ = ("key_id", "tonic", "mode", "display_name", "weight")
+
+    def __init__(self, key_id: str, tonic: str, mode: str, display_name: str, weight: float) -> None:
+        self.key_id = key_id
+        self.tonic = tonic
+        self.mode = mode
+        self.display_name = display_name
+        self.weight = weight
+
+    @classmethod
+    def from_profile(cls, profile: KeyProfile) -> "KeyRecord":
+        return cls(
+            profile["key_id"],
+            profile["tonic"],
+            sys.intern(profile["mode"]),
+            profile["display_name"],
+            profile["weight"],
+        )
+
+    def __repr__(self) -> str:
+        return f"KeyRecord({self.key_id!r})"
@@ -0,0 +1,154 @@
+import json
+import re
+from pathlib import Path
+
+
+LETTERS = "CDEFGAB"
+NATURAL_PITCH_CLASSES = (0, 2, 4, 5, 7, 9, 11)
+SCALE_STEPS = {
+    "major": (0, 2, 4, 5, 7, 9, 11),
+    "minor": (0, 2, 3, 5, 7, 8, 10),
+}
+ROMAN_DEGREES = {"I": 1, "II": 2, "III": 3, "IV": 4, "V": 5, "VI": 6, "VII": 7}
+
+# Built by `python progression_pattern_collection.py --voicings-only` (or any full build).
+VOICING_TABLE_PATH = Path("chord_voicing_table.json")
+VOICING_TABLE_VERSION = 1
+VOICING_OCTAVE = 4
+
+# Chord members each extension asks for above the root, read the way music21 reads
+# figured bass: accidentals alter the diatonic note, and altered ninths/thirteenths
+# replace the triad rather than sit on top of it. "6" is a first-inversion triad.
+EXTENSION_FIGURES = {
+    "": ("3", "5"),
+    "6": ("3", "5"),
+    "7": ("3", "5", "7"),
+    "9": ("3", "5", "7", "9"),
+    "maj7": ("3", "5", "maj7"),
+    "7b9": ("7", "b9"),
+    "7#9": ("7", "#9"),
+    "7#9b13": ("7", "#9", "b13"),
+}
+
+_NUMERAL_PATTERN = re.compile(r"^(?P<numeral>[IViv]+)(?P<diminished>[°o]?)(?P<extension>.*)$")
+
+SpelledPitch = tuple[int, int]  # (index into LETTERS, alteration in semitones)
+
+
+def parse_tonic(tonic: str) -> SpelledPitch:
+    letter = LETTERS.index(tonic[:1].upper())
+    alter = 0
+    for accidental in tonic[1:]:
+        if accidental == "#":
+            alter += 1
+        elif accidental in "-b":
+            alter -= 1
+        else:
+            raise ValueError(f"unrecognised tonic {tonic!r}")
+    return letter, alter
+
+
+def _pitch_class(pitch: SpelledPitch) -> int:
+    letter, alter = pitch
+    return NATURAL_PITCH_CLASSES[letter] + alter
+
+
+def _spell(letter: int, pitch_class: int) -> SpelledPitch:
+    letter %= 7
+    alter = (pitch_class - NATURAL_PITCH_CLASSES[letter] + 6) % 12 - 6
+    return letter, alter
+
+
+def _scale_degree(tonic: SpelledPitch, mode: str, degree: int) -> SpelledPitch:
+    step = (degree - 1) % 7
+    return _spell(tonic[0] + step, _pitch_class(tonic) + SCALE_STEPS[mode][step])
+
+
+def _above_root(root: SpelledPitch, steps: int, semitones: int) -> SpelledPitch:
+    return _spell(root[0] + steps, _pitch_class(root) + semitones)
+
+
+def chord_pitches(numeral: str, tonic: str, mode: str) -> list[SpelledPitch]:
+    match = _NUMERAL_PATTERN.match(numeral)
+    if match is None or match["numeral"].upper() not in ROMAN_DEGREES:
+        raise ValueError(f"unrecognised roman numeral {numeral!r}")
+    if match["extension"] not in EXTENSION_FIGURES:
+        raise ValueError(f"unsupported extension in {numeral!r}")
+    if mode not in SCALE_STEPS:
+        raise ValueError(f"unsupported mode {mode!r}")
+
+    key_tonic = parse_tonic(tonic)
+    degree = ROMAN_DEGREES[match["numeral"].upper()]
+    diminished = bool(match["diminished"])
+    major_third = match["numeral"].isupper() and not diminished
+    root = _scale_degree(key_tonic, mode, degree)
+
+    pitches = [root]
+    for figure in EXTENSION_FIGURES[match["extension"]]:
+        if figure == "3":
+            pitches.append(_above_root(root, 2, 4 if major_third else 3))
+        elif figure == "5":
+            pitches.append(_above_root(root, 4, 6 if diminished else 7))
+        elif figure == "7" and diminished:
+            pitches.append(_above_root(root, 6, 9))
+        elif figure == "maj7":
+            pitches.append(_above_root(root, 6, 11))
+        else:
+            accidental = {"#": 1, "b": -1}.get(figure[0], 0)
+            letter, alter = _scale_degree(key_tonic, mode, degree + int(figure.lstrip("#b")) - 1)
+            pitches.append((letter, alter + accidental))
+    return pitches
+
+
+def chord_midi_notes(numeral: str, tonic: str, mode: str, octave: int = 4) -> list[int]:
+    # Every member is placed in the same octave by letter name, so Cb4 is 59 and B#4 is 72.
+    base = 12 * (octave + 1)
+    return [base + _pitch_class(pitch) for pitch in chord_pitches(numeral, tonic, mode)]
+
+
+def key_signature_sharps(tonic: str, mode: str) -> int:
+    # Position of the major-mode tonic on the circle of fifths, counted from C.
+    letter, alter = parse_tonic(tonic)
+    if mode == "minor":
+        letter, alter = _spell(letter + 2, _pitch_class((letter, alter)) + 3)
+    return (0, 2, 4, -1, 1, 3, 5)[letter] + 7 * alter
+
+
+def voicing_table_key(tonic: str, mode: str) -> str:
+    return f"{tonic} {mode}"
+
+
+def load_voicing_table(path: Path = VOICING_TABLE_PATH) -> dict[str, dict[str, tuple[int, ...]]]:
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as handle:
+        payload = json.load(handle)
+    if payload.get("version") != VOICING_TABLE_VERSION or payload.get("octave") != VOICING_OCTAVE:
+        print(f"Ignoring stale voicing table at {path}; rebuild it with --voicings-only")
+        return {}
+    return {
+        key_name: {numeral: tuple(notes) for numeral, notes in chords.items()}
+        for key_name, chords in payload["keys"].items()
+    }
+
+
+_voicing_table: dict[str, dict[str, tuple[int, ...]]] | None = None
+
+
+def use_voicing_table(path: Path) -> None:
+    # Loads the table now rather than on the first chord, and from a directory other than the cwd.
+    global _voicing_table
+    _voicing_table = load_voicing_table(path)
+
+
+def chord_notes(numeral: str, tonic: str, mode: str) -> tuple[int, ...]:
+    # Table lookup; chords the table does not cover are resolved once and remembered.
+    global _voicing_table
+    if _voicing_table is None:
+        _voicing_table = load_voicing_table()
+
+    chords = _voicing_table.setdefault(voicing_table_key(tonic, mode), {})
+    notes = chords.get(numeral)
+    if notes is None:
+        notes = chords[numeral] = tuple(chord_midi_notes(numeral, tonic, mode, VOICING_OCTAVE))
+    return notes
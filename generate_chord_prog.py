@@ -1,70 +1,119 @@
+import argparse
 import json
 import random
-import subprocess
+from collections.abc import Iterable, Iterator
 from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
 
-from music21 import instrument, key as m21key, meter, roman, stream, tempo
+import numpy as np
 
-from chord_generation_model import EmotionScore, KeyProfile, ProgressionSummary
-from nlp.matcher import prompt_to_emotion_bias
-from section_chord_prog_gen import get_all_section_progression
+from chord_generation_model import EmotionScore, GeneratedProgression, KeyProfile, KeyRecord, PatternRecord, ProgressionSummary, StreamedSection
+from chord_voicing import VOICING_TABLE_PATH, use_voicing_table
+from midi_writer import render_midi_bytes, write_midi
+from nlp.matcher import EMOTIONS, lexicon_phrases, prompt_to_emotion_bias, prompts_to_emotion_biases
+from pattern_index import PatternIndex
+from pattern_store import PATTERN_STORE_PATH, load_pattern_store
+from result_cache import ResultCache, data_fingerprint
+from sampling import AliasSampler, pick_cumulative
+from section_chord_prog_gen import (
+    SECTION_CONFIG,
+    DistributionCache,
+    DistributionLRU,
+    compile_sections,
+    generate_sections,
+    iter_sections,
+    prefill_section_distributions,
+)
+
+if TYPE_CHECKING:
+    from playback import PlaybackQueue
 
 FLUIDSYNTH_PATH = "/usr/bin/fluidsynth"
 SOUNDFONT_PATH = "/usr/share/sounds/sf2/default-GM.sf2"
 DEFAULT_BPM = 150  # keep fixed in 70–80 range
+# Modules whose code decides what a seed generates; persisted results are keyed by their sources.
+GENERATION_SOURCES = (
+    "generate_chord_prog.py",
+    "section_chord_prog_gen.py",
+    "pattern_index.py",
+    "pattern_store.py",
+    "sampling.py",
+    "chord_generation_model.py",
+    "chord_voicing.py",
+    "midi_writer.py",
+)
+
+
+def get_effective_weights(pattern_index: PatternIndex, prompt_emotion_bias: EmotionScore) -> tuple[np.ndarray, np.ndarray]:
+    effective_weights = pattern_index.effective_weights(prompt_emotion_bias)
+    candidates = np.flatnonzero(effective_weights > 0)
+    return effective_weights[candidates], candidates
 
 
-def get_effective_weights(
-    progression_pattern_summary: list[ProgressionSummary],
+def prompt_sampler(
+    pattern_index: PatternIndex,
     prompt_emotion_bias: EmotionScore,
-) -> tuple[list[float], list[ProgressionSummary]]:
-    weights: list[float] = []
-    candidates: list[ProgressionSummary] = []
+    distributions: DistributionCache | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    # Running totals and positions of the prompt-level candidates, for pick_cumulative.
+    key = (id(pattern_index), "prompt", tuple(prompt_emotion_bias.items()))
+    cached = distributions.get(key) if distributions is not None else None
+    if cached is not None:
+        return cached
+    weights, candidates = get_effective_weights(pattern_index, prompt_emotion_bias)
+    sampler = (np.cumsum(weights), candidates)
+    if distributions is not None:
+        distributions[key] = sampler
+    return sampler
 
-    for pattern in progression_pattern_summary:
-        pattern_emotion_score = pattern["emotion_scores"]
-        emotion_score = 0.0
-        for emotion_id in pattern_emotion_score.keys():
-            emotion_score += (
-                prompt_emotion_bias.get(emotion_id, 0.0) * pattern_emotion_score.get(emotion_id, 0.0)
-            )
 
-        motion_penalty = len(set(pattern["roman_sequence"])) / len(pattern["roman_sequence"])
-        effective_weight = emotion_score * pattern["base_weight"] * motion_penalty
-        if effective_weight > 0:
-            weights.append(effective_weight)
-            candidates.append(pattern)
+def prefill_distributions(
+    pattern_index: PatternIndex,
+    prompt_emotion_biases: list[EmotionScore],
+    distributions: DistributionCache | None = None,
+) -> DistributionCache:
+    # Weights for many prompts at once: one product for the prompt-level pick and one per mode and
+    # section, stored where prompt_sampler and section_distribution look them up.
+    distributions = {} if distributions is None else distributions
+    pending: dict[tuple, EmotionScore] = {}
+    for emotion_bias in prompt_emotion_biases:
+        key = (id(pattern_index), "prompt", tuple(emotion_bias.items()))
+        if key not in distributions:
+            pending[key] = emotion_bias
+    if pending:
+        for key, effective_weights in zip(pending, pattern_index.effective_weights_many(list(pending.values()))):
+            candidates = np.flatnonzero(effective_weights > 0)
+            distributions[key] = (np.cumsum(effective_weights[candidates]), candidates)
+    for mode in pattern_index.mode_names:
+        prefill_section_distributions(prompt_emotion_biases, pattern_index.for_mode(mode), distributions)
+    return distributions
 
-    return weights, candidates
+
+def warm_up_distributions(pattern_index: PatternIndex, distributions: DistributionLRU, batch_size: int = 64) -> int:
+    # Prefill the shared cache with the quantized bias of every lexicon phrase on its own, which
+    # covers most single-phrase prompts. Returns how many distinct biases were prefilled.
+    emotion_biases: dict[tuple, EmotionScore] = {}
+    for row in prompts_to_emotion_biases(lexicon_phrases()):
+        emotion_bias = distributions.quantize(dict(zip(EMOTIONS, row)))
+        emotion_biases.setdefault(tuple(emotion_bias.items()), emotion_bias)
+    pending = list(emotion_biases.values())
+    for start in range(0, len(pending), batch_size):
+        prefill_distributions(pattern_index, pending[start:start + batch_size], distributions)
+    return len(pending)
 
 
 def build_midi_progression(
     roman_sequence: list[str],
-    key_choice: KeyProfile,
-    output_path: Path,
+    key_choice: KeyRecord,
+    output_path: Path | BinaryIO,
     bpm: int = DEFAULT_BPM,
 ) -> None:
-    key_signature = m21key.Key(key_choice["tonic"], key_choice["mode"])
-    part = stream.Part()
-    part.append(instrument.Piano())
-    part.append(tempo.MetronomeMark(number=bpm))
-    part.append(meter.TimeSignature("4/4"))
-    part.append(key_signature)
-
-    for numeral in roman_sequence:
-        rn = roman.RomanNumeral(numeral, key_signature)
-        rn.quarterLength = 4
-        rn.writeAsChord = True
-        for p in rn.pitches:
-            p.octave = 4
-        part.append(rn)
-
-    score = stream.Score()
-    score.append(part)
-    score.write("midi", fp=str(output_path))
+    write_midi(roman_sequence, key_choice.tonic, key_choice.mode, output_path, bpm=bpm)
 
 
 def play_midi_file(midi_path: Path) -> None:
+    import subprocess
+
     try:
         subprocess.run(
             [FLUIDSYNTH_PATH, "-ni", SOUNDFONT_PATH, str(midi_path)],
@@ -74,63 +123,244 @@ def play_midi_file(midi_path: Path) -> None:
         print(f"Cannot run fluidsynth at {FLUIDSYNTH_PATH}; MIDI saved at {midi_path}.")
 
 
-def load_data() -> tuple[list[ProgressionSummary], list[KeyProfile]]:
-    with open("progression_pattern_summary.json", mode="r", encoding="utf-8") as file:
+def build_key_samplers(key_profile: list[KeyProfile]) -> dict[str, tuple[list[KeyRecord], AliasSampler]]:
+    keys = [KeyRecord.from_profile(profile) for profile in key_profile]
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]] = {}
+    for mode in sorted({key.mode for key in keys}):
+        filtered_key_profile = [key for key in keys if key.mode == mode]
+        key_samplers[mode] = (filtered_key_profile, AliasSampler([key.weight for key in filtered_key_profile]))
+    return key_samplers
+
+
+def load_pattern_index(data_dir: Path = Path(".")) -> PatternIndex:
+    # The binary store is preferred unless the JSON summary was edited after it was exported.
+    summary_path = data_dir / "progression_pattern_summary.json"
+    store_path = data_dir / PATTERN_STORE_PATH
+    if store_path.exists() and (not summary_path.exists() or store_path.stat().st_mtime >= summary_path.stat().st_mtime):
+        return PatternIndex.from_store(load_pattern_store(store_path))
+    with summary_path.open(mode="r", encoding="utf-8") as file:
         progression_pattern_summary: list[ProgressionSummary] = json.load(file)
-    with open("key_profile.json", mode="r", encoding="utf-8") as file:
+    return PatternIndex.from_summaries(progression_pattern_summary)
+
+
+def load_data(data_dir: Path = Path(".")) -> tuple[PatternIndex, dict[str, tuple[list[KeyRecord], AliasSampler]]]:
+    with (data_dir / "key_profile.json").open(mode="r", encoding="utf-8") as file:
         key_profile: list[KeyProfile] = json.load(file)
-    return progression_pattern_summary, key_profile
+    pattern_index = load_pattern_index(data_dir)
+    for mode in pattern_index.mode_names:
+        compile_sections(pattern_index.for_mode(mode))
+    use_voicing_table(data_dir / VOICING_TABLE_PATH)
+    return pattern_index, build_key_samplers(key_profile)
+
+
+def open_result_cache(data_dir: Path = Path("."), directory: Path | None = None) -> ResultCache:
+    # Only a persisted cache can outlive the data or code it was filled with, so only it pays for
+    # hashing them; the sources of every module that shapes a result are hashed with the data.
+    if directory is None:
+        return ResultCache("", directory)
+    data_paths = [
+        data_dir / "key_profile.json",
+        data_dir / "progression_pattern_summary.json",
+        data_dir / PATTERN_STORE_PATH,
+        data_dir / VOICING_TABLE_PATH,
+    ]
+    source_paths = [Path(__file__).with_name(name) for name in GENERATION_SOURCES]
+    return ResultCache(data_fingerprint(data_paths + source_paths, SECTION_CONFIG), directory)
 
 
 def choose_key(
     mode: str,
-    key_profile: list[KeyProfile],
-) -> KeyProfile:
-    filtered_key_profile = [key for key in key_profile if key["mode"] == mode]
-    return random.choices(
-        filtered_key_profile,
-        weights=[key["weight"] for key in filtered_key_profile],
-        k=1,
-    )[0]
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
+    rng: random.Random | None = None,
+) -> KeyRecord:
+    filtered_key_profile, sampler = key_samplers[mode]
+    return filtered_key_profile[sampler.sample(rng)]
+
+
+def choose_pattern_and_key(
+    prompt_emotion_bias: EmotionScore,
+    pattern_index: PatternIndex,
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
+    distributions: DistributionCache | None = None,
+    rng: random.Random | None = None,
+) -> tuple[PatternRecord, KeyRecord, bool]:
+    cumulative, candidates = prompt_sampler(pattern_index, prompt_emotion_bias, distributions)
+
+    used_fallback = not len(candidates) or cumulative[-1] == 0
+    if used_fallback:
+        chosen_pattern: PatternRecord = pattern_index.patterns[pattern_index.base_weight_sampler.sample(rng)]
+    else:
+        chosen_pattern = pattern_index.patterns[candidates[pick_cumulative(cumulative, rng)]]
+    return chosen_pattern, choose_key(chosen_pattern.mode, key_samplers, rng), bool(used_fallback)
+
+
+def generate_progression(
+    prompt_emotion_bias: EmotionScore,
+    pattern_index: PatternIndex,
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
+    distributions: DistributionCache | None = None,
+    rng: random.Random | None = None,
+) -> GeneratedProgression:
+    chosen_pattern, key_choice, used_fallback = choose_pattern_and_key(prompt_emotion_bias, pattern_index, key_samplers, distributions, rng)
+
+    sections = generate_sections(prompt_emotion_bias, pattern_index.for_mode(chosen_pattern.mode), distributions=distributions, rng=rng)
+    return {
+        "emotion_bias": prompt_emotion_bias,
+        "mode": key_choice.mode,
+        "key_id": key_choice.key_id,
+        "tonic": key_choice.tonic,
+        "sections": [{"section": section, "chords": chords} for section, chords in sections],
+        "used_fallback": used_fallback,
+    }
+
+
+def stream_progression(
+    prompt_emotion_bias: EmotionScore,
+    pattern_index: PatternIndex,
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
+    sections: dict | Iterable[tuple[str, dict]] = SECTION_CONFIG,
+    include_midi: bool = False,
+    bpm: int = DEFAULT_BPM,
+    distributions: DistributionCache | None = None,
+    rng: random.Random | None = None,
+) -> Iterator[StreamedSection]:
+    # Same draws as generate_progression, but each section is handed over (with its own MIDI file
+    # when asked) as soon as it is sampled, so playback of the intro can start while the rest is
+    # still being drawn. Every section file starts at time zero with its own header; they only join
+    # up without gaps through a player that keeps one synth running and starts each queued file
+    # where the last one ended, as PlaybackQueue does. sections may be a lazy iterable of any length.
+    chosen_pattern, key_choice, used_fallback = choose_pattern_and_key(prompt_emotion_bias, pattern_index, key_samplers, distributions, rng)
+    mode_index = pattern_index.for_mode(chosen_pattern.mode)
+    for index, (section, chords) in enumerate(iter_sections(prompt_emotion_bias, mode_index, sections, distributions, rng)):
+        yield {
+            "index": index,
+            "section": section,
+            "chords": chords,
+            "mode": key_choice.mode,
+            "key_id": key_choice.key_id,
+            "tonic": key_choice.tonic,
+            "used_fallback": used_fallback,
+            "midi": render_midi_bytes(chords, key_choice.tonic, key_choice.mode, bpm) if include_midi else None,
+        }
+
+
+def progression_chords(progression: GeneratedProgression) -> list[str]:
+    return [chord for section in progression["sections"] for chord in section["chords"]]
+
+
+def render_progression_midi(progression: GeneratedProgression, bpm: int = DEFAULT_BPM) -> bytes:
+    return render_midi_bytes(progression_chords(progression), progression["tonic"], progression["mode"], bpm)
+
+
+def generate_with_midi(
+    prompt_emotion_bias: EmotionScore,
+    pattern_index: PatternIndex,
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
+    seed: int | None = None,
+    bpm: int = DEFAULT_BPM,
+    cache: ResultCache | None = None,
+    distributions: DistributionCache | None = None,
+) -> tuple[GeneratedProgression, bytes]:
+    # A seed gets its own generator, so the same bias and seed always give the same sections and
+    # MIDI and the pair can be served from the cache. Without one the module-level random is used.
+    if seed is None:
+        progression = generate_progression(prompt_emotion_bias, pattern_index, key_samplers, distributions)
+        return progression, render_progression_midi(progression, bpm)
+
+    key = cache.key(prompt_emotion_bias, seed, bpm) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    progression = generate_progression(prompt_emotion_bias, pattern_index, key_samplers, distributions, random.Random(seed))
+    midi = render_progression_midi(progression, bpm)
+    if cache is not None:
+        cache.put(key, progression, midi)
+    return progression, midi
 
 
 def run_once(
     prompt: str,
-    progression_pattern_summary: list[ProgressionSummary],
-    key_profile: list[KeyProfile],
+    pattern_index: PatternIndex,
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
     midi_path: Path,
+    player: "PlaybackQueue | None" = None,
+    seed: int | None = None,
+    cache: ResultCache | None = None,
 ) -> None:
     prompt_emotion_bias, debug_info = prompt_to_emotion_bias(prompt)
-    weights, candidates = get_effective_weights(progression_pattern_summary, prompt_emotion_bias)
+    progression, midi = generate_with_midi(prompt_emotion_bias, pattern_index, key_samplers, seed, DEFAULT_BPM, cache)
 
-    if not weights or sum(weights) == 0:
+    if progression["used_fallback"]:
         print("------- no strong matches; using fallback weights -------")
-        candidates = progression_pattern_summary
-        weights = [p["base_weight"] for p in progression_pattern_summary]
+    for section in progression["sections"]:
+        print("section: ", section["section"])
+        print("chord progression: ", section["chords"])
+
+    midi_path.write_bytes(midi)
+    print(f"Wrote MIDI to {midi_path}")
+    if player is None:
+        play_midi_file(midi_path)
+    else:
+        player.play(midi_path, replace=True)
 
-    chosen_pattern: ProgressionSummary = random.choices(candidates, weights, k=1)[0]
-    key_choice = choose_key(chosen_pattern["mode"], key_profile)
-    mode_filtered_chord_progression_pattern = [pattern for pattern in progression_pattern_summary if pattern["mode"] == chosen_pattern["mode"]]
 
-    final_chord_progression = get_all_section_progression(prompt_emotion_bias, mode_filtered_chord_progression_pattern)
+def stream_once(
+    prompt: str,
+    pattern_index: PatternIndex,
+    key_samplers: dict[str, tuple[list[KeyRecord], AliasSampler]],
+    midi_path: Path,
+    player: "PlaybackQueue",
+    seed: int | None = None,
+) -> None:
+    # Like run_once, but each section is queued for playback the moment it is drawn. The player reads
+    # the file when it is queued, so midi_path is reused for every section and then holds the whole piece.
+    prompt_emotion_bias, debug_info = prompt_to_emotion_bias(prompt)
+    rng = random.Random(seed) if seed is not None else None
+    player.stop()
+    chords: list[str] = []
+    for section in stream_progression(prompt_emotion_bias, pattern_index, key_samplers, include_midi=True, rng=rng):
+        if section["index"] == 0 and section["used_fallback"]:
+            print("------- no strong matches; using fallback weights -------")
+        print("section: ", section["section"])
+        print("chord progression: ", section["chords"])
+        midi_path.write_bytes(section["midi"])
+        player.play(midi_path)
+        chords.extend(section["chords"])
 
-    build_midi_progression(final_chord_progression, key_choice, midi_path, bpm=DEFAULT_BPM)
+    midi_path.write_bytes(render_midi_bytes(chords, section["tonic"], section["mode"], DEFAULT_BPM))
     print(f"Wrote MIDI to {midi_path}")
-    play_midi_file(midi_path)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate chord progressions from emotion prompts.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="print and queue each section for playback as soon as it is drawn",
+    )
+    return parser.parse_args()
 
 
 def main() -> None:
-    progression_pattern_summary, key_profile = load_data()
+    from playback import PlaybackQueue
+
+    args = parse_args()
+    pattern_index, key_samplers = load_data()
     midi_path = Path("generated_progression.mid")
 
     print("Enter an emotion prompt (or 'q' to quit).")
-    while True:
-        prompt = input("Emotion prompt> ").strip()
-        if prompt.lower() in {"q", "quit", "exit"}:
-            break
-        if not prompt:
-            continue
-        run_once(prompt, progression_pattern_summary, key_profile, midi_path)
+    with PlaybackQueue(FLUIDSYNTH_PATH, SOUNDFONT_PATH) as player:
+        while True:
+            prompt = input("Emotion prompt> ").strip()
+            if prompt.lower() in {"q", "quit", "exit"}:
+                break
+            if not prompt:
+                continue
+            if args.stream and player.available:
+                stream_once(prompt, pattern_index, key_samplers, midi_path, player)
+            else:
+                run_once(prompt, pattern_index, key_samplers, midi_path, player)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,446 @@
+import argparse
+import base64
+import gc
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from generate_chord_prog import (
+    DEFAULT_BPM,
+    generate_with_midi,
+    load_data,
+    open_result_cache,
+    prefill_distributions,
+    stream_progression,
+    warm_up_distributions,
+)
+from nlp.matcher import EMOTIONS, preload_lexicon, prompts_to_emotion_biases
+from section_chord_prog_gen import (
+    DEFAULT_BIAS_STEP,
+    DEFAULT_DISTRIBUTION_CACHE_BYTES,
+    SECTION_CONFIG,
+    DistributionLRU,
+    section_plan,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_REQUEST_BYTES = 64 * 1024
+DEFAULT_MAX_BATCH = 16
+
+GenerationJob = tuple[str, bool, int | None]
+
+
+class GenerationState:
+    # Everything a request reads. Loaded once in the parent before forking, so workers share
+    # the mapped pattern store and the parent's heap pages copy-on-write.
+    def __init__(
+        self,
+        data_dir: Path,
+        bpm: int,
+        cache_dir: Path | None = None,
+        bias_step: float = DEFAULT_BIAS_STEP,
+        distribution_cache_bytes: int = DEFAULT_DISTRIBUTION_CACHE_BYTES,
+        warm_up: bool = False,
+    ) -> None:
+        self.pattern_index, self.key_samplers = load_data(data_dir)
+        preload_lexicon()
+        self.bpm = bpm
+        # Seeded requests are memoized; each worker keeps its own LRU and cache_dir is shared.
+        self.results = open_result_cache(data_dir, cache_dir)
+        # Warmed entries are inherited copy-on-write; each worker's later entries stay its own.
+        self.distributions = DistributionLRU(distribution_cache_bytes, bias_step)
+        self.warmed_biases = warm_up_distributions(self.pattern_index, self.distributions) if warm_up else 0
+
+    def generate(self, prompt: str, include_midi: bool, seed: int | None = None) -> dict:
+        return self.generate_batch([(prompt, include_midi, seed)])[0]
+
+    def generate_batch(self, jobs: list[GenerationJob]) -> list[dict]:
+        # Every prompt's candidate weights are scored together before any job is sampled.
+        emotion_biases = [
+            self.distributions.quantize(dict(zip(EMOTIONS, row)))
+            for row in prompts_to_emotion_biases([prompt for prompt, _, _ in jobs])
+        ]
+        if len(jobs) > 1:
+            prefill_distributions(self.pattern_index, emotion_biases, self.distributions)
+        responses = []
+        for (prompt, include_midi, seed), emotion_bias in zip(jobs, emotion_biases):
+            progression, midi = generate_with_midi(
+                emotion_bias, self.pattern_index, self.key_samplers, seed, self.bpm, self.results, self.distributions
+            )
+            response = dict(progression, prompt=prompt)
+            if seed is not None:
+                response["seed"] = seed
+            if include_midi:
+                response["midi_base64"] = base64.b64encode(midi).decode("ascii")
+            responses.append(response)
+        return responses
+
+    def stream(self, prompt: str, include_midi: bool, seed: int | None = None, section_names: list[str] | None = None) -> Iterator[dict]:
+        # Not batched or cached: the point is to hand over the first section before the rest exist.
+        # A seed draws the same sections as the same seed on /generate.
+        emotion_bias = self.distributions.quantize(dict(zip(EMOTIONS, prompts_to_emotion_biases([prompt])[0])))
+        sections = section_plan(section_names) if section_names else SECTION_CONFIG
+        rng = random.Random(seed) if seed is not None else None
+        for streamed in stream_progression(
+            emotion_bias, self.pattern_index, self.key_samplers, sections, include_midi, self.bpm, self.distributions, rng
+        ):
+            response = dict(streamed, prompt=prompt)
+            midi = response.pop("midi")
+            if include_midi:
+                response["midi_base64"] = base64.b64encode(midi).decode("ascii")
+            yield response
+
+
+class MicroBatcher:
+    # Requests from concurrent handler threads queue up while a batch is running and go out
+    # together as the next one. max_delay optionally holds a batch open for late arrivals.
+    def __init__(self, run_batch: Callable[[list], list], max_batch: int = DEFAULT_MAX_BATCH, max_delay: float = 0.0) -> None:
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: queue.SimpleQueue[tuple[object, Future]] = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: object) -> object:
+        future: Future = Future()
+        self._pending.put((job, future))
+        return future.result()
+
+    def _collect(self) -> list[tuple[object, Future]]:
+        batch = [self._pending.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                if self.max_delay:
+                    batch.append(self._pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                else:
+                    batch.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                results = self.run_batch([job for job, _ in batch])
+            except Exception:
+                # Rerun the jobs one at a time, so only the job that fails gets the exception.
+                for job, future in batch:
+                    try:
+                        future.set_result(self.run_batch([job])[0])
+                    except Exception as exc:
+                        future.set_exception(exc)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ProgressionPalette/1"
+    # Headers and body go out in separate writes; without this, keep-alive clients wait on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status: HTTPStatus, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            state = self.server.state
+            self._send_json(
+                HTTPStatus.OK,
+                {
+                    "status": "ok",
+                    "pid": os.getpid(),
+                    "patterns": len(state.pattern_index),
+                    "result_cache": state.results.stats(),
+                    "distribution_cache": state.distributions.stats(),
+                },
+            )
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json_lines(self, payloads: Iterator[dict]) -> None:
+        # Chunked NDJSON: one line per payload, written as soon as it is produced. The first payload
+        # is produced before the headers go out, so a failure there still gets a JSON 500.
+        first = next(payloads, None)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            if first is not None:
+                self._write_chunk(json.dumps(first).encode("utf-8") + b"\n")
+            for payload in payloads:
+                self._write_chunk(json.dumps(payload).encode("utf-8") + b"\n")
+        except Exception as exc:
+            # Headers are gone already; dropping the connection tells the client the stream is incomplete.
+            self.close_connection = True
+            print(f"Streaming {self.path} failed: {exc!r}", file=sys.stderr)
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_error(self, exc: Exception) -> None:
+        print(f"Generation for {self.path} failed: {exc!r}", file=sys.stderr)
+        self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "generation failed"})
+
+    def do_POST(self) -> None:
+        if self.path not in ("/generate", "/generate/stream"):
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "invalid Content-Length"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            self._send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "request body too large"})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "request body is not valid JSON"})
+            return
+        prompt = request.get("prompt") if isinstance(request, dict) else None
+        if not isinstance(prompt, str) or not prompt.strip():
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "expected a non-empty string 'prompt'"})
+            return
+        seed = request.get("seed")
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "'seed' must be an integer"})
+            return
+        if self.path == "/generate":
+            try:
+                response = self.server.generate((prompt.strip(), bool(request.get("midi", True)), seed))
+            except Exception as exc:
+                self._send_error(exc)
+                return
+            self._send_json(HTTPStatus.OK, response)
+            return
+        section_names = request.get("sections")
+        if section_names is not None and (
+            not isinstance(section_names, list) or not all(isinstance(name, str) and name in SECTION_CONFIG for name in section_names)
+        ):
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": f"'sections' must be a list of {', '.join(SECTION_CONFIG)}"})
+            return
+        try:
+            self._send_json_lines(self.server.state.stream(prompt.strip(), bool(request.get("midi", True)), seed, section_names))
+        except Exception as exc:
+            self._send_error(exc)
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class GenerationHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        listener: socket.socket,
+        state: GenerationState,
+        access_log: bool,
+        parent_pid: int | None = None,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        batch_delay: float = 0.0,
+    ) -> None:
+        # The listening socket is created once in the parent and shared by every worker.
+        super().__init__(listener.getsockname()[:2], GenerationRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        self.state = state
+        self.access_log = access_log
+        self.parent_pid = parent_pid
+        # Started here rather than in GenerationState, so every forked worker gets its own thread.
+        self.batcher = MicroBatcher(state.generate_batch, max_batch, batch_delay) if max_batch > 1 else None
+
+    def generate(self, job: GenerationJob) -> dict:
+        if self.batcher is None:
+            return self.state.generate(*job)
+        return self.batcher.submit(job)
+
+    def service_actions(self) -> None:
+        # Runs between polls in serve_forever; a worker whose parent died stops accepting work.
+        if self.parent_pid is not None and os.getppid() != self.parent_pid:
+            sys.exit(0)
+
+
+def _run_worker(listener: socket.socket, state: GenerationState, server_options: dict, parent_pid: int) -> None:
+    # Forked workers start with the parent's random state; reseed so they do not repeat each other.
+    random.seed()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = GenerationHTTPServer(listener, state, parent_pid=parent_pid, **server_options)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _fork_worker(listener: socket.socket, state: GenerationState, server_options: dict) -> int:
+    parent_pid = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(listener, state, server_options, parent_pid)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve(
+    data_dir: Path,
+    host: str,
+    port: int,
+    workers: int,
+    bpm: int,
+    access_log: bool,
+    cache_dir: Path | None = None,
+    max_batch: int = DEFAULT_MAX_BATCH,
+    batch_delay: float = 0.0,
+    bias_step: float = DEFAULT_BIAS_STEP,
+    distribution_cache_bytes: int = DEFAULT_DISTRIBUTION_CACHE_BYTES,
+    warm_up: bool = False,
+) -> None:
+    state = GenerationState(data_dir, bpm, cache_dir, bias_step, distribution_cache_bytes, warm_up)
+    if warm_up:
+        print(f"Warmed the distribution cache with {state.warmed_biases} lexicon biases ({state.distributions.stats()['bytes']} bytes)")
+    server_options = {"access_log": access_log, "max_batch": max_batch, "batch_delay": batch_delay}
+    listener = socket.create_server((host, port), backlog=socket.SOMAXCONN)
+    print(f"Serving {len(state.pattern_index)} patterns on http://{host}:{listener.getsockname()[1]} with {workers} worker(s)")
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        server = GenerationHTTPServer(listener, state, **server_options)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    # Keep the preloaded objects out of the collector's way so workers do not dirty their pages.
+    gc.freeze()
+    children = {_fork_worker(listener, state, server_options) for _ in range(workers)}
+    stopping = False
+
+    def stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; starting a replacement")
+            children.add(_fork_worker(listener, state, server_options))
+    listener.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve chord progression generation over HTTP/JSON.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to bind, 0 for any (default: {DEFAULT_PORT})")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="pre-forked worker processes sharing the loaded data (default: CPU count)",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=Path("."),
+        help="directory holding the pattern store or summary, key_profile.json and the voicing table (default: cwd)",
+    )
+    parser.add_argument("--bpm", type=int, default=DEFAULT_BPM, help=f"tempo of returned MIDI (default: {DEFAULT_BPM})")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="share seeded results between workers and restarts here")
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=DEFAULT_MAX_BATCH,
+        help=f"requests scored together per worker, 1 to disable batching (default: {DEFAULT_MAX_BATCH})",
+    )
+    parser.add_argument(
+        "--batch-delay-ms",
+        type=float,
+        default=0.0,
+        help="wait this long for more requests before running a batch (default: 0, only what is already queued)",
+    )
+    parser.add_argument(
+        "--bias-step",
+        type=float,
+        default=DEFAULT_BIAS_STEP,
+        help=f"round prompt biases to this step so similar prompts share cached distributions, 0 to keep them exact (default: {DEFAULT_BIAS_STEP})",
+    )
+    parser.add_argument(
+        "--distribution-cache-mb",
+        type=float,
+        default=DEFAULT_DISTRIBUTION_CACHE_BYTES / (1024 * 1024),
+        help=f"memory bound of each worker's distribution cache (default: {DEFAULT_DISTRIBUTION_CACHE_BYTES // (1024 * 1024)})",
+    )
+    parser.add_argument("--warm-up", action="store_true", help="prefill the distribution cache from the lexicon's phrases")
+    parser.add_argument("--access-log", action="store_true", help="log every request to stderr")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    serve(
+        args.data_dir,
+        args.host,
+        args.port,
+        args.workers,
+        args.bpm,
+        args.access_log,
+        args.cache_dir,
+        args.max_batch,
+        args.batch_delay_ms / 1000,
+        args.bias_step,
+        int(args.distribution_cache_mb * 1024 * 1024),
+        args.warm_up,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import struct
+from pathlib import Path
+from typing import BinaryIO
+
+from chord_voicing import chord_notes, key_signature_sharps
+
+
+# Matches what music21's score.write("midi") produced for build_midi_progression.
+TICKS_PER_QUARTER = 10080
+CHORD_QUARTER_LENGTH = 4
+NOTE_VELOCITY = 90
+PIANO_PROGRAM = 0
+TRACK_NAME = b"Piano"
+
+_END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+
+def _variable_length(value: int) -> bytes:
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def _track_chunk(events: list[tuple[int, bytes]]) -> bytes:
+    body = b"".join(_variable_length(delta) + data for delta, data in events) + _END_OF_TRACK
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+
+def render_midi_bytes(
+    roman_sequence: list[str],
+    tonic: str,
+    mode: str,
+    bpm: int,
+) -> bytes:
+    tempo = round(60_000_000 / bpm)
+    conductor = [
+        (0, b"\xff\x51\x03" + tempo.to_bytes(3, "big")),
+        (0, b"\xff\x59\x02" + struct.pack(">bB", key_signature_sharps(tonic, mode), 1 if mode == "minor" else 0)),
+        (0, b"\xff\x58\x04\x04\x02\x18\x08"),
+    ]
+
+    chord_ticks = CHORD_QUARTER_LENGTH * TICKS_PER_QUARTER
+    piano = [
+        (0, b"\xff\x03" + bytes([len(TRACK_NAME)]) + TRACK_NAME),
+        (0, bytes([0xC0, PIANO_PROGRAM])),
+    ]
+    for numeral in roman_sequence:
+        notes = chord_notes(numeral, tonic, mode)
+        piano.extend((0, bytes([0x90, note, NOTE_VELOCITY])) for note in notes)
+        piano.extend((chord_ticks if i == 0 else 0, bytes([0x80, note, 0])) for i, note in enumerate(notes))
+
+    header = b"MThd" + struct.pack(">IHHH", 6, 1, 2, TICKS_PER_QUARTER)
+    return header + _track_chunk(conductor) + _track_chunk(piano)
+
+
+def write_midi(
+    roman_sequence: list[str],
+    tonic: str,
+    mode: str,
+    output: Path | BinaryIO,
+    bpm: int,
+) -> None:
+    data = render_midi_bytes(roman_sequence, tonic, mode, bpm)
+    if isinstance(output, (str, Path)):
+        Path(output).write_bytes(data)
+    else:
+        output.write(data)
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from pathlib import Path
+import hashlib
 import json
+import os
+import pickle
 import re
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, NamedTuple, Tuple
 
 EMOTIONS = [
     "suspenseful_tense",
@@ -24,6 +28,10 @@ MODIFIERS = {
 }
 
 LEXICON_PATH = Path(__file__).resolve().parent / "phrase_lexicon.json"
+LEXICON_CACHE_PATH = LEXICON_PATH.with_name("phrase_lexicon.compiled.pickle")
+LEXICON_CACHE_VERSION = 1
+
+BIAS_CACHE_SIZE = 4096
 
 
 def _normalize_text(text: str) -> str:
@@ -33,9 +41,7 @@ def _normalize_text(text: str) -> str:
     return lowered
 
 
-def _load_lexicon() -> Dict[str, Dict[str, float]]:
-    with LEXICON_PATH.open("r", encoding="utf-8") as handle:
-        raw = json.load(handle)
+def _parse_lexicon(raw: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
     lexicon: Dict[str, Dict[str, float]] = {}
     for phrase, contribs in raw.items():
         cleaned = _normalize_text(phrase)
@@ -43,9 +49,111 @@ def _load_lexicon() -> Dict[str, Dict[str, float]]:
     return lexicon
 
 
-LEXICON = _load_lexicon()
+# Trie nodes are plain dicts keyed by token, which keeps the pickled matcher cheap to load.
+# Tokens never contain whitespace, so these two marker keys cannot collide with a token.
+_TrieNode = Dict[str, Any]
+_PHRASE_KEY = ""
+_MODIFIER_KEY = " "
+
+
+def _compile_matcher(lexicon: Dict[str, Dict[str, float]], modifiers: Dict[str, float]) -> _TrieNode:
+    # Phrases and modifiers share one token trie, so a single walk from each position finds
+    # the longest modifier and the longest phrase starting there.
+    root: _TrieNode = {}
+    for phrase in lexicon:
+        node = root
+        for token in phrase.split():
+            node = node.setdefault(token, {})
+        if node is not root:
+            node.setdefault(_PHRASE_KEY, phrase)
+    for modifier, multiplier in modifiers.items():
+        node = root
+        for token in modifier.split():
+            node = node.setdefault(token, {})
+        if node is not root:
+            node.setdefault(_MODIFIER_KEY, (" ".join(modifier.split()), multiplier))
+    return root
+
+
+def _lexicon_cache_key(raw: bytes) -> str:
+    digest = hashlib.sha256(raw)
+    digest.update(json.dumps([LEXICON_CACHE_VERSION, MODIFIERS], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_compiled_lexicon(use_cache: bool = True) -> Tuple[Dict[str, Dict[str, float]], _TrieNode]:
+    # The parsed lexicon and its trie are pickled beside phrase_lexicon.json, keyed by a hash
+    # of the lexicon and modifiers; a stale, unreadable or unwritable cache just means a rebuild.
+    raw = LEXICON_PATH.read_bytes()
+    key = _lexicon_cache_key(raw)
+    if use_cache:
+        try:
+            with LEXICON_CACHE_PATH.open("rb") as handle:
+                cached_key, lexicon, matcher = pickle.load(handle)
+            if cached_key == key:
+                return lexicon, matcher
+        except Exception:
+            pass
+
+    lexicon = _parse_lexicon(json.loads(raw))
+    matcher = _compile_matcher(lexicon, MODIFIERS)
+    if use_cache:
+        tmp_path = LEXICON_CACHE_PATH.with_name(f"{LEXICON_CACHE_PATH.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("wb") as handle:
+                pickle.dump((key, lexicon, matcher), handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, LEXICON_CACHE_PATH)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+    return lexicon, matcher
+
+
+_compiled_lexicon: Tuple[Dict[str, Dict[str, float]], _TrieNode] | None = None
 
 
+def _get_compiled_lexicon() -> Tuple[Dict[str, Dict[str, float]], _TrieNode]:
+    global _compiled_lexicon
+    if _compiled_lexicon is None:
+        _compiled_lexicon = load_compiled_lexicon()
+    return _compiled_lexicon
+
+
+def preload_lexicon() -> None:
+    _get_compiled_lexicon()
+
+
+def lexicon_phrases() -> List[str]:
+    return list(_get_compiled_lexicon()[0])
+
+
+def __getattr__(name: str) -> Any:
+    # LEXICON and LEXICON_MATCHER are loaded on first use rather than at import.
+    if name == "LEXICON":
+        return _get_compiled_lexicon()[0]
+    if name == "LEXICON_MATCHER":
+        return _get_compiled_lexicon()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _longest_matches(
+    matcher: _TrieNode,
+    tokens: List[str],
+    index: int,
+) -> Tuple[Tuple[Tuple[str, float], int] | None, Tuple[str, int] | None]:
+    modifier_match = None
+    phrase_match = None
+    node = matcher
+    position = index
+    while position < len(tokens):
+        node = node.get(tokens[position])
+        if node is None:
+            break
+        position += 1
+        if _MODIFIER_KEY in node:
+            modifier_match = (node[_MODIFIER_KEY], position - index)
+        if _PHRASE_KEY in node:
+            phrase_match = (node[_PHRASE_KEY], position - index)
+    return modifier_match, phrase_match
 
 
 def _neutral_bias() -> Dict[str, float]:
@@ -56,47 +164,42 @@ def _clamp(value: float, low: float = 0.0, high: float = 1.0) -> float:
     return max(low, min(high, value))
 
 
-def prompt_to_emotion_bias(prompt: str) -> Tuple[Dict[str, float], Dict[str, Any]]:
-    normalized = _normalize_text(prompt)
-    tokens = normalized.split() if normalized else []
-    phrases = sorted(LEXICON.keys(), key=lambda p: len(p.split()), reverse=True)
+class _PromptMatch(NamedTuple):
+    tokens: Tuple[str, ...]
+    bias: Tuple[float, ...]
+    matched_phrases: Tuple[Tuple[str, float, int], ...]
+    applied_modifiers: Tuple[Tuple[str, str, float], ...]
+    ignored_modifiers: Tuple[str, ...]
 
-    modifier_tokens = {tuple(k.split()): v for k, v in MODIFIERS.items()}
-    modifier_lengths = sorted({len(k) for k in modifier_tokens}, reverse=True)
+
+@lru_cache(maxsize=BIAS_CACHE_SIZE)
+def _match_prompt(normalized: str) -> _PromptMatch:
+    # Cached per normalized prompt, so results are immutable tuples; callers build dicts from them.
+    tokens = normalized.split() if normalized else []
+    lexicon, matcher = _get_compiled_lexicon()
 
     bias: Dict[str, float] = {emotion: 0.0 for emotion in EMOTIONS}
-    matched_phrases: List[Dict[str, Any]] = []
-    applied_modifiers: List[Dict[str, Any]] = []
+    matched_phrases: List[Tuple[str, float, int]] = []
+    applied_modifiers: List[Tuple[str, str, float]] = []
     ignored_modifiers: List[str] = []
     pending_modifier: Tuple[str, float] | None = None
 
     index = 0
     while index < len(tokens):
-        modifier_applied = False
-        for length in modifier_lengths:
-            if index + length > len(tokens):
-                continue
-            window = tuple(tokens[index:index + length])
-            if window in modifier_tokens:
-                if pending_modifier is None:
-                    pending_modifier = (" ".join(window), modifier_tokens[window])
-                else:
-                    print("Modifier ignored because it is probably repeated")
-                    ignored_modifiers.append(" ".join(window))
-                index += length
-                modifier_applied = True
-                break
-        if modifier_applied:
+        modifier_match, longest_phrase = _longest_matches(matcher, tokens, index)
+        if modifier_match:
+            modifier, length = modifier_match
+            if pending_modifier is None:
+                pending_modifier = modifier
+            else:
+                ignored_modifiers.append(modifier[0])
+            index += length
             continue
 
         phrase_match = None
         phrase_len = 0
-        for phrase in phrases:
-            phrase_tokens = phrase.split()
-            if tokens[index:index + len(phrase_tokens)] == phrase_tokens:
-                phrase_match = phrase
-                phrase_len = len(phrase_tokens)
-                break
+        if longest_phrase:
+            phrase_match, phrase_len = longest_phrase
 
         if phrase_match:
             multiplier = 1.0
@@ -104,47 +207,68 @@ def prompt_to_emotion_bias(prompt: str) -> Tuple[Dict[str, float], Dict[str, Any
             if pending_modifier:
                 modifier_label, multiplier = pending_modifier
                 pending_modifier = None
-            contribs = LEXICON.get(phrase_match, {})
+            contribs = lexicon.get(phrase_match, {})
             for emotion, value in contribs.items():
                 bias[emotion] += max(0.0, value * multiplier)
-            matched_phrases.append(
-                {
-                    "phrase": phrase_match,
-                    "multiplier": multiplier,
-                    "start_index": index,
-                }
-            )
+            matched_phrases.append((phrase_match, multiplier, index))
             if modifier_label:
-                applied_modifiers.append(
-                    {"modifier": modifier_label, "phrase": phrase_match, "multiplier": multiplier}
-                )
+                applied_modifiers.append((modifier_label, phrase_match, multiplier))
             index += phrase_len
             continue
 
         index += 1
 
-    if all(value == 0.0 for value in bias.values()):
-        return _neutral_bias(), {
-            "normalized_prompt": normalized,
-            "tokens": tokens,
-            "matched_phrases": matched_phrases,
-            "applied_modifiers": applied_modifiers,
-            "ignored_modifiers": ignored_modifiers,
-            "final_bias": _neutral_bias(),
-        }
-
     max_value = max(bias.values()) if bias else 1.0
-    if max_value == 0:
+    if all(value == 0.0 for value in bias.values()) or max_value == 0:
         normalized_bias = _neutral_bias()
     else:
         normalized_bias = {k: _clamp(v / max_value) for k, v in bias.items()}
 
-    debug_info = {
+    return _PromptMatch(
+        tokens=tuple(tokens),
+        bias=tuple(normalized_bias[emotion] for emotion in EMOTIONS),
+        matched_phrases=tuple(matched_phrases),
+        applied_modifiers=tuple(applied_modifiers),
+        ignored_modifiers=tuple(ignored_modifiers),
+    )
+
+
+def _debug_info(normalized: str, match: _PromptMatch) -> Dict[str, Any]:
+    return {
         "normalized_prompt": normalized,
-        "tokens": tokens,
-        "matched_phrases": matched_phrases,
-        "applied_modifiers": applied_modifiers,
-        "ignored_modifiers": ignored_modifiers,
-        "final_bias": normalized_bias,
+        "tokens": list(match.tokens),
+        "matched_phrases": [
+            {"phrase": phrase, "multiplier": multiplier, "start_index": start_index}
+            for phrase, multiplier, start_index in match.matched_phrases
+        ],
+        "applied_modifiers": [
+            {"modifier": modifier, "phrase": phrase, "multiplier": multiplier}
+            for modifier, phrase, multiplier in match.applied_modifiers
+        ],
+        "ignored_modifiers": list(match.ignored_modifiers),
+        "final_bias": dict(zip(EMOTIONS, match.bias)),
     }
-    return normalized_bias, debug_info
+
+
+def prompt_to_emotion_bias(prompt: str) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    normalized = _normalize_text(prompt)
+    match = _match_prompt(normalized)
+    for _ in match.ignored_modifiers:
+        print("Modifier ignored because it is probably repeated")
+    return dict(zip(EMOTIONS, match.bias)), _debug_info(normalized, match)
+
+
+def prompts_to_emotion_biases(prompts: List[str]) -> List[List[float]]:
+    # One row per prompt, columns in EMOTIONS order. Debug info is not built here;
+    # use prompt_debug_info for the prompts that need it.
+    return [list(_match_prompt(_normalize_text(prompt)).bias) for prompt in prompts]
+
+
+def prompt_debug_info(prompt: str) -> Dict[str, Any]:
+    normalized = _normalize_text(prompt)
+    return _debug_info(normalized, _match_prompt(normalized))
+
+
+def bias_cache_stats() -> Dict[str, int]:
+    info = _match_prompt.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -0,0 +1,172 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+from chord_generation_model import (
+    DOMINANT_FUNCTION,
+    EMOTION_IDS,
+    NUMERALS,
+    EmotionScore,
+    PatternRecord,
+    ProgressionSummary,
+    roman_sequence_id,
+)
+from pattern_store import PatternStore, StoredPatterns
+from sampling import AliasSampler
+
+
+class PatternIndex:
+    # Column view of progression_pattern_summary.json (or its binary store), built once at load time so that
+    # weighting every pattern for a prompt is a single matrix-vector product.
+
+    def __init__(self, patterns: Sequence[PatternRecord]) -> None:
+        self.patterns = patterns
+        self._store: PatternStore | None = None
+        self._store_rows = slice(None)
+        self.emotion_matrix = np.array(
+            [pattern.emotion_vector for pattern in patterns], dtype=np.float64
+        ).reshape(len(patterns), len(EMOTION_IDS))
+        self.base_weight = np.array([pattern.base_weight for pattern in patterns], dtype=np.float64)
+        self.motion_penalty = np.array(
+            [len(set(pattern.roman_codes)) / len(pattern.roman_codes) for pattern in patterns],
+            dtype=np.float64,
+        )
+        self.sequence_length = np.array([len(pattern.function_codes) for pattern in patterns], dtype=np.int64)
+        self.dominant_count = np.array([pattern.function_codes.count(DOMINANT_FUNCTION) for pattern in patterns], dtype=np.int64)
+        self.ending_function = np.array([pattern.function_codes[-1] for pattern in patterns], dtype=np.int64)
+        self.modes = np.array([pattern.mode for pattern in patterns], dtype=object)
+        self.base_motion_weight = self.base_weight * self.motion_penalty
+
+        sequence_ids: dict[tuple[int, ...], int] = {}
+        for pattern in patterns:
+            if pattern.roman_codes not in sequence_ids:
+                sequence_ids[pattern.roman_codes] = pattern.sequence_id
+        self.sequence_ids = np.array([sequence_ids[pattern.roman_codes] for pattern in patterns], dtype=np.int64)
+        self._init_caches()
+
+    @classmethod
+    def from_summaries(cls, summaries: list[ProgressionSummary]) -> "PatternIndex":
+        return cls([PatternRecord.from_summary(summary) for summary in summaries])
+
+    @classmethod
+    def from_store(cls, store: PatternStore, rows: slice = slice(None)) -> "PatternIndex":
+        # Same columns as __init__, derived from the store's id arrays. The emotion matrix and the
+        # weight columns stay views into the shared mapping. They are float32, so seeded picks can
+        # differ from an index built from the JSON summary.
+        index = cls.__new__(cls)
+        index.patterns = StoredPatterns(store, rows)
+        index._store = store
+        index._store_rows = rows
+
+        roman_codes = store.numeral_codes[store.roman_ids[rows]]
+        function_codes = store.function_codes[store.function_ids[rows]]
+        lengths = store.lengths[rows].astype(np.int64)
+
+        # Distinct numerals per row: sorted padding (-1) comes first and counts as one extra value.
+        sorted_codes = np.sort(roman_codes, axis=1)
+        distinct = 1 + np.count_nonzero(np.diff(sorted_codes, axis=1), axis=1) - (lengths < roman_codes.shape[1])
+
+        index.emotion_matrix = store.emotion_matrix[rows]
+        index.base_weight = store.base_weight[rows]
+        index.motion_penalty = distinct / lengths
+        index.sequence_length = lengths
+        index.dominant_count = np.count_nonzero(function_codes == DOMINANT_FUNCTION, axis=1)
+        index.ending_function = function_codes[np.arange(len(lengths)), lengths - 1]
+        index.modes = np.array(store.modes, dtype=object)[store.mode_ids[rows]]
+        if store.base_motion_weight is not None:
+            index.base_motion_weight = store.base_motion_weight[rows]
+        else:
+            index.base_motion_weight = index.base_weight * index.motion_penalty
+
+        if store.sequence_ids is not None:
+            index.sequence_ids = store.sequence_ids[rows]
+        else:
+            # Older stores: hash each distinct row once. Rows of uint8 store ids pack into one
+            # integer each, which unique() handles far faster than rows.
+            row_ids = store.roman_ids[rows]
+            if row_ids.shape[1] <= 8:
+                row_keys = np.zeros(len(row_ids), dtype=np.uint64)
+                for column in range(row_ids.shape[1]):
+                    row_keys = (row_keys << np.uint64(8)) | row_ids[:, column]
+            else:
+                row_keys = row_ids
+            _, first_rows, inverse = np.unique(row_keys, axis=0, return_index=True, return_inverse=True)
+            distinct_ids = np.array(
+                [roman_sequence_id(NUMERALS.decode(code for code in roman_codes[row].tolist() if code >= 0)) for row in first_rows],
+                dtype=np.int64,
+            )
+            index.sequence_ids = distinct_ids[inverse.reshape(-1)]
+        index._init_caches()
+        return index
+
+    def _init_caches(self) -> None:
+        self.mode_names: list[str] = sorted(set(self.modes.tolist()))
+        self._mode_indexes: dict[str, "PatternIndex"] = {}
+        self.subsets: dict[tuple, "PatternSubset"] = {}
+        self._base_weight_sampler: AliasSampler | None = None
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def emotion_vector(self, emotion_bias: EmotionScore) -> np.ndarray:
+        return np.array([emotion_bias.get(emotion_id, 0.0) for emotion_id in EMOTION_IDS], dtype=np.float64)
+
+    def emotion_vectors(self, emotion_biases: Sequence[EmotionScore]) -> np.ndarray:
+        return np.array(
+            [[emotion_bias.get(emotion_id, 0.0) for emotion_id in EMOTION_IDS] for emotion_bias in emotion_biases],
+            dtype=np.float64,
+        ).reshape(len(emotion_biases), len(EMOTION_IDS))
+
+    def effective_weights(self, emotion_bias: EmotionScore) -> np.ndarray:
+        return (self.emotion_matrix @ self.emotion_vector(emotion_bias)) * self.base_motion_weight
+
+    def effective_weights_many(self, emotion_biases: Sequence[EmotionScore]) -> np.ndarray:
+        # One row per bias from a single matrix product. Rows of a larger batch can differ from
+        # effective_weights in the last bit, so a batch of one takes the same path as a single bias.
+        if len(emotion_biases) == 1:
+            return self.effective_weights(emotion_biases[0])[np.newaxis]
+        return (self.emotion_vectors(emotion_biases) @ self.emotion_matrix.T) * self.base_motion_weight
+
+    def subset(self, mask: np.ndarray) -> "PatternSubset":
+        return PatternSubset(self, np.flatnonzero(mask))
+
+    @property
+    def base_weight_sampler(self) -> AliasSampler:
+        if self._base_weight_sampler is None:
+            self._base_weight_sampler = AliasSampler(self.base_weight)
+        return self._base_weight_sampler
+
+    def for_mode(self, mode: str) -> "PatternIndex":
+        if mode not in self._mode_indexes:
+            if self._store is not None and self._store_rows == slice(None):
+                start, stop = self._store.mode_ranges.get(mode, (0, 0))
+                self._mode_indexes[mode] = PatternIndex.from_store(self._store, slice(start, stop))
+            else:
+                self._mode_indexes[mode] = PatternIndex([pattern for pattern in self.patterns if pattern.mode == mode])
+        return self._mode_indexes[mode]
+
+
+class PatternSubset:
+    # Rows of a PatternIndex that pass a fixed constraint set. Only the positions (and their
+    # sequence ids) are kept; weights are read through the parent's columns, so a store-backed
+    # index keeps sharing the mapped matrix. Positions refer to the parent index.
+
+    def __init__(self, pattern_index: PatternIndex, positions: np.ndarray) -> None:
+        self.pattern_index = pattern_index
+        self.positions = positions
+        self.sequence_ids = pattern_index.sequence_ids[positions]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def effective_weights(self, emotion_bias: EmotionScore) -> np.ndarray:
+        pattern_index = self.pattern_index
+        emotion_matrix = pattern_index.emotion_matrix[self.positions]
+        return (emotion_matrix @ pattern_index.emotion_vector(emotion_bias)) * pattern_index.base_motion_weight[self.positions]
+
+    def effective_weights_many(self, emotion_biases: Sequence[EmotionScore]) -> np.ndarray:
+        if len(emotion_biases) == 1:
+            return self.effective_weights(emotion_biases[0])[np.newaxis]
+        pattern_index = self.pattern_index
+        emotion_matrix = pattern_index.emotion_matrix[self.positions]
+        return (pattern_index.emotion_vectors(emotion_biases) @ emotion_matrix.T) * pattern_index.base_motion_weight[self.positions]
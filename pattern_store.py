@@ -0,0 +1,194 @@
+import json
+import mmap
+import os
+import struct
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+from chord_generation_model import EMOTION_IDS, FUNCTIONS, NUMERALS, PatternRecord, ProgressionSummary, roman_sequence_id
+
+
+PATTERN_STORE_PATH = Path("progression_pattern_store.bin")
+STORE_MAGIC = b"PPSTORE\x00"
+STORE_VERSION = 1
+STORE_ALIGNMENT = 64
+PAD_ID = 255
+
+# magic, format version, header length. The JSON header follows, then the column arrays,
+# each starting on a STORE_ALIGNMENT boundary so they can be viewed straight out of the map.
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset: int) -> int:
+    return -(-offset // STORE_ALIGNMENT) * STORE_ALIGNMENT
+
+
+def _intern(vocabulary: dict[str, int], value: str) -> int:
+    code = vocabulary.setdefault(value, len(vocabulary))
+    if code >= PAD_ID:
+        raise ValueError(f"pattern store vocabulary is limited to {PAD_ID} entries")
+    return code
+
+
+def write_pattern_store(patterns: list[ProgressionSummary], path: Path) -> None:
+    # Patterns are grouped by mode, keeping their order within a mode, so every mode is one
+    # contiguous row range and PatternIndex.for_mode can use plain slices of the map.
+    modes = sorted({pattern["mode"] for pattern in patterns})
+    ordered = sorted(patterns, key=lambda pattern: modes.index(pattern["mode"]))
+    width = max((len(pattern["roman_sequence"]) for pattern in ordered), default=0)
+
+    numerals: dict[str, int] = {}
+    functions: dict[str, int] = {}
+    roman_ids = np.full((len(ordered), width), PAD_ID, dtype=np.uint8)
+    function_ids = np.full((len(ordered), width), PAD_ID, dtype=np.uint8)
+    for row, pattern in enumerate(ordered):
+        for column, (numeral, function) in enumerate(zip(pattern["roman_sequence"], pattern["function_sequence"])):
+            roman_ids[row, column] = _intern(numerals, numeral)
+            function_ids[row, column] = _intern(functions, function)
+
+    mode_ids = np.array([modes.index(pattern["mode"]) for pattern in ordered], dtype=np.uint8)
+    arrays = {
+        "roman_ids": roman_ids,
+        "function_ids": function_ids,
+        "lengths": np.array([len(pattern["roman_sequence"]) for pattern in ordered], dtype=np.uint8),
+        "mode_ids": mode_ids,
+        "count": np.array([pattern["count"] for pattern in ordered], dtype=np.uint32),
+        "base_weight": np.array([pattern["base_weight"] for pattern in ordered], dtype=np.float32),
+        "emotion_matrix": np.array(
+            [[pattern["emotion_scores"].get(emotion_id, 0.0) for emotion_id in EMOTION_IDS] for pattern in ordered],
+            dtype=np.float32,
+        ).reshape(len(ordered), len(EMOTION_IDS)),
+        "sequence_ids": np.array([roman_sequence_id(pattern["roman_sequence"]) for pattern in ordered], dtype=np.int64),
+        # Kept at float64 and derived from the stored float32 base weight, so it is exactly what
+        # PatternIndex would otherwise compute into private memory in every process.
+        "base_motion_weight": np.array(
+            [
+                float(np.float32(pattern["base_weight"])) * (len(set(pattern["roman_sequence"])) / len(pattern["roman_sequence"]))
+                for pattern in ordered
+            ],
+            dtype=np.float64,
+        ),
+    }
+
+    layout: dict[str, dict] = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({
+        "pattern_count": len(ordered),
+        "numerals": list(numerals),
+        "functions": list(functions),
+        "modes": modes,
+        "emotion_ids": list(EMOTION_IDS),
+        "mode_ranges": {
+            mode: [int(np.searchsorted(mode_ids, code)), int(np.searchsorted(mode_ids, code, side="right"))]
+            for code, mode in enumerate(modes)
+        },
+        "arrays": layout,
+    }).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    # Written beside the target and renamed over it, so processes that still map the old
+    # file keep reading a consistent copy.
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as handle:
+        handle.write(_PREAMBLE.pack(STORE_MAGIC, STORE_VERSION, len(header)))
+        handle.write(header)
+        for name, array in arrays.items():
+            handle.seek(data_start + layout[name]["offset"])
+            handle.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+class PatternStore:
+    # Read-only view of a pattern store file. The column arrays are views into one shared
+    # mapping, so every process that loads the same file shares its pages.
+
+    def __init__(self, path: Path) -> None:
+        with path.open("rb") as handle:
+            self._buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self._buffer, 0)
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{path} is not a progression pattern store")
+        if version != STORE_VERSION:
+            raise ValueError(f"unsupported pattern store version {version} in {path}")
+        header = json.loads(self._buffer[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        if header["emotion_ids"] != list(EMOTION_IDS):
+            raise ValueError(f"{path} was written for a different emotion set")
+
+        self.path = path
+        self.numerals: tuple[str, ...] = tuple(header["numerals"])
+        self.functions: tuple[str, ...] = tuple(header["functions"])
+        self.modes: tuple[str, ...] = tuple(header["modes"])
+        self.mode_ranges: dict[str, tuple[int, int]] = {mode: tuple(bounds) for mode, bounds in header["mode_ranges"].items()}
+        # Store ids translated to the process-wide symbol codes; padding maps to -1.
+        self.numeral_codes = np.full(PAD_ID + 1, -1, dtype=np.int64)
+        self.numeral_codes[:len(self.numerals)] = NUMERALS.codes(self.numerals)
+        self.function_codes = np.full(PAD_ID + 1, -1, dtype=np.int64)
+        self.function_codes[:len(self.functions)] = FUNCTIONS.codes(self.functions)
+
+        data_start = _align(_PREAMBLE.size + header_length)
+        arrays: dict[str, np.ndarray] = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            arrays[name] = np.frombuffer(
+                self._buffer,
+                dtype=np.dtype(spec["dtype"]),
+                count=int(np.prod(shape)),
+                offset=data_start + spec["offset"],
+            ).reshape(shape)
+        self.roman_ids = arrays["roman_ids"]
+        self.function_ids = arrays["function_ids"]
+        self.lengths = arrays["lengths"]
+        self.mode_ids = arrays["mode_ids"]
+        self.count = arrays["count"]
+        self.base_weight = arrays["base_weight"]
+        self.emotion_matrix = arrays["emotion_matrix"]
+        # Absent from older stores; PatternIndex derives them then.
+        self.sequence_ids: np.ndarray | None = arrays.get("sequence_ids")
+        self.base_motion_weight: np.ndarray | None = arrays.get("base_motion_weight")
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def pattern(self, row: int) -> PatternRecord:
+        # float32 columns are rounded back to the 4 decimals the JSON summary carries.
+        length = int(self.lengths[row])
+        return PatternRecord(
+            tuple(self.numeral_codes[self.roman_ids[row, :length]].tolist()),
+            tuple(self.function_codes[self.function_ids[row, :length]].tolist()),
+            self.modes[self.mode_ids[row]],
+            int(self.count[row]),
+            round(float(self.base_weight[row]), 4),
+            tuple(round(score, 4) for score in self.emotion_matrix[row].tolist()),
+        )
+
+
+class StoredPatterns(Sequence):
+    # Stands in for a list of PatternRecords; a pattern is only decoded when it is chosen.
+
+    def __init__(self, store: PatternStore, rows: slice = slice(None)) -> None:
+        self.store = store
+        self._start, self._stop, _ = rows.indices(len(store))
+
+    def __len__(self) -> int:
+        return max(self._stop - self._start, 0)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        position = int(position)
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("pattern index out of range")
+        return self.store.pattern(self._start + position)
+
+
+def load_pattern_store(path: Path = PATTERN_STORE_PATH) -> PatternStore:
+    return PatternStore(path)
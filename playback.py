@@ -0,0 +1,263 @@
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from pathlib import Path
+
+DEFAULT_RENDER_WORKERS = 2
+DEFAULT_SAMPLE_RATE = 44100
+DEFAULT_TEMPO = 500_000  # microseconds per quarter note when a file sets none
+ALL_NOTES_OFF = 123
+
+# Seconds from the start of the file, and the fluidsynth shell command to send then.
+TimedCommand = tuple[float, str]
+
+
+def fluidsynth_available(fluidsynth_path: str) -> bool:
+    return shutil.which(fluidsynth_path) is not None
+
+
+def _read_variable_length(data: bytes, offset: int) -> tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, offset
+
+
+def _channel_command(status: int, data: bytes) -> str | None:
+    kind, channel = status & 0xF0, status & 0x0F
+    if kind == 0x90 and data[1]:
+        return f"noteon {channel} {data[0]} {data[1]}"
+    if kind in (0x80, 0x90):
+        return f"noteoff {channel} {data[0]}"
+    if kind == 0xB0:
+        return f"cc {channel} {data[0]} {data[1]}"
+    if kind == 0xC0:
+        return f"prog {channel} {data[0]}"
+    if kind == 0xE0:
+        return f"pitch_bend {channel} {data[0] | data[1] << 7}"
+    return None
+
+
+def midi_commands(data: bytes) -> tuple[list[TimedCommand], float]:
+    # Flattens a standard MIDI file into timed shell commands for a running synth, plus the
+    # file's length in seconds. Meta events other than tempo and all sysex are skipped.
+    if data[:4] != b"MThd":
+        raise ValueError("not a standard MIDI file")
+    header_length, _, track_count, division = struct.unpack_from(">IHHH", data, 4)
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+
+    events: list[tuple[int, int, str | int]] = []  # tick, order, command or new tempo
+    offset = 8 + header_length
+    for _ in range(track_count):
+        chunk_type, chunk_length = struct.unpack_from(">4sI", data, offset)
+        position, end = offset + 8, offset + 8 + chunk_length
+        offset = end
+        if chunk_type != b"MTrk":
+            continue
+        tick = 0
+        status = 0
+        while position < end:
+            delta, position = _read_variable_length(data, position)
+            tick += delta
+            if data[position] & 0x80:
+                status = data[position]
+                position += 1
+            if status == 0xFF:
+                meta_type = data[position]
+                length, position = _read_variable_length(data, position + 1)
+                if meta_type == 0x51 and length == 3:
+                    events.append((tick, len(events), int.from_bytes(data[position:position + 3], "big")))
+                position += length
+                status = 0
+            elif status in (0xF0, 0xF7):
+                length, position = _read_variable_length(data, position)
+                position += length
+                status = 0
+            else:
+                size = 1 if status & 0xE0 == 0xC0 else 2
+                command = _channel_command(status, data[position:position + size])
+                position += size
+                if command is not None:
+                    events.append((tick, len(events), command))
+        events.append((tick, len(events), ""))
+
+    commands: list[TimedCommand] = []
+    tempo, tempo_tick, tempo_seconds = DEFAULT_TEMPO, 0, 0.0
+    seconds = 0.0
+    for tick, _, event in sorted(events):
+        seconds = tempo_seconds + (tick - tempo_tick) * tempo / (division * 1_000_000)
+        if isinstance(event, int):
+            tempo, tempo_tick, tempo_seconds = event, tick, seconds
+        elif event:
+            commands.append((seconds, event))
+    return commands, seconds
+
+
+class PlaybackQueue:
+    # Playback goes through one fluidsynth shell that is started with the queue and keeps its
+    # soundfont loaded; a background thread feeds it note events, so the caller never waits and
+    # queued files follow each other on one clock with no restart between them. Offline WAV
+    # renders still need a fluidsynth process per file (the shell cannot write a file) and run
+    # in parallel on a small thread pool.
+    def __init__(
+        self,
+        fluidsynth_path: str,
+        soundfont_path: str,
+        render_workers: int = DEFAULT_RENDER_WORKERS,
+    ) -> None:
+        self.fluidsynth_path = fluidsynth_path
+        self.soundfont_path = soundfont_path
+        self.available = fluidsynth_available(fluidsynth_path)
+        self._snapshots = tempfile.TemporaryDirectory(prefix="progression_playback_")
+        self._snapshot_ids = count()
+        # Queued files carry the stop generation they were queued under; stop() bumps it and wakes
+        # the player, which drops the rest of the file and anything it had already dequeued.
+        self._pending: queue.Queue[tuple[int, list[TimedCommand], float] | None] = queue.Queue()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Condition(self._lock)
+        self._synth: subprocess.Popen | None = None
+        self._player: threading.Thread | None = None
+        self._renderer = ThreadPoolExecutor(max_workers=max(1, render_workers), thread_name_prefix="render")
+        if self.available:
+            self._start_synth()
+
+    def _start_synth(self) -> bool:
+        try:
+            self._synth = subprocess.Popen(
+                [self.fluidsynth_path, self.soundfont_path],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                bufsize=1,
+            )
+        except OSError as exc:
+            print(f"Cannot run fluidsynth at {self.fluidsynth_path}: {exc}")
+            self._synth = None
+        return self._synth is not None
+
+    def _send(self, command: str) -> None:
+        # Called with the lock held. A synth that died is started again for the next command.
+        if self._synth is None or self._synth.poll() is not None:
+            if not self._start_synth():
+                return
+        try:
+            self._synth.stdin.write(command + "\n")
+        except OSError:
+            self._synth = None
+
+    def _snapshot(self, midi_path: Path) -> Path:
+        snapshot = Path(self._snapshots.name) / f"{next(self._snapshot_ids):06d}.mid"
+        shutil.copyfile(midi_path, snapshot)
+        return snapshot
+
+    def _play_loop(self) -> None:
+        # Each file starts where the previous one ended, unless playback had already run dry.
+        clock = 0.0
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            generation, commands, duration = item
+            start = max(clock, time.monotonic())
+            channels: set[str] = set()
+            with self._lock:
+                for at, command in commands:
+                    if self._stopped.wait_for(lambda: generation != self._generation, start + at - time.monotonic()):
+                        for channel in channels:
+                            self._send(f"cc {channel} {ALL_NOTES_OFF} 0")
+                        clock = 0.0
+                        break
+                    self._send(command)
+                    channels.add(command.split()[1])
+                else:
+                    clock = start + duration
+
+    def play(self, midi_path: Path, replace: bool = False) -> bool:
+        if not self.available:
+            print(f"Cannot run fluidsynth at {self.fluidsynth_path}; MIDI saved at {midi_path}.")
+            return False
+        commands, duration = midi_commands(Path(midi_path).read_bytes())
+        if replace:
+            self.stop()
+        if self._player is None:
+            self._player = threading.Thread(target=self._play_loop, name="playback", daemon=True)
+            self._player.start()
+        with self._lock:
+            self._pending.put((self._generation, commands, duration))
+        return True
+
+    def stop(self) -> None:
+        # Drops anything still queued and silences whatever is playing now.
+        while True:
+            try:
+                self._pending.get_nowait()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._generation += 1
+            self._stopped.notify_all()
+
+    def _render(self, midi_path: Path, wav_path: Path, sample_rate: int) -> Path:
+        try:
+            subprocess.run(
+                [
+                    self.fluidsynth_path, "-ni", "-F", str(wav_path), "-T", "wav", "-r", str(sample_rate),
+                    self.soundfont_path, str(midi_path),
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+        finally:
+            midi_path.unlink(missing_ok=True)
+        return wav_path
+
+    def render(self, midi_path: Path, wav_path: Path, sample_rate: int = DEFAULT_SAMPLE_RATE) -> Future:
+        if not self.available:
+            raise FileNotFoundError(f"Cannot run fluidsynth at {self.fluidsynth_path}")
+        return self._renderer.submit(self._render, self._snapshot(midi_path), Path(wav_path), sample_rate)
+
+    def render_many(
+        self,
+        jobs: list[tuple[Path, Path]],
+        sample_rate: int = DEFAULT_SAMPLE_RATE,
+    ) -> list[Path]:
+        futures = [self.render(midi_path, wav_path, sample_rate) for midi_path, wav_path in jobs]
+        return [future.result() for future in futures]
+
+    def close(self, wait: bool = True) -> None:
+        if not wait:
+            self.stop()
+        if self._player is not None:
+            self._pending.put(None)
+            self._player.join()
+            self._player = None
+        self._renderer.shutdown(wait=True)
+        self._snapshots.cleanup()
+        with self._lock:
+            if self._synth is not None:
+                try:
+                    self._synth.stdin.write("quit\n")
+                    self._synth.stdin.close()
+                    self._synth.wait(timeout=2)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._synth.kill()
+                self._synth = None
+
+    def __enter__(self) -> "PlaybackQueue":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close(wait=False)
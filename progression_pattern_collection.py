@@ -1,7 +1,21 @@
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import contextlib
+import hashlib
 import json
-from music21 import converter, key as m21key, stream, chord as m21chord
+import math
+import os
+import time
+from collections.abc import Iterable, Iterator
+from functools import partial
+import numpy as np
+from music21 import common, converter, key as m21key, roman, stream, chord as m21chord
+
+from chord_voicing import VOICING_OCTAVE, VOICING_TABLE_PATH, VOICING_TABLE_VERSION, voicing_table_key
+from pattern_store import PATTERN_STORE_PATH, write_pattern_store
+from section_chord_prog_gen import extension_labels
 
 
 
@@ -20,6 +34,21 @@ FUNCTION_MAP = {
     "V": "D", "vii°": "D", "VII": "D"
 }
 
+# Bump whenever extract_progressions output changes so cached extractions are reparsed.
+EXTRACTOR_VERSION = 1
+CACHE_DIR_NAME = ".progression_cache"
+
+PARTIAL_SUMMARY_FORMAT = "progression_pattern_partial"
+PARTIAL_SUMMARY_VERSION = 1
+# Emotion sums are kept as integers in units of 2**-SUM_SCALE_BITS so shard sums add up exactly.
+SUM_SCALE_BITS = 80
+
+# Every spelling music21 gives a key signature of up to seven sharps or flats.
+VOICING_TONICS = {
+    "major": ("C", "G", "D", "A", "E", "B", "F#", "C#", "F", "B-", "E-", "A-", "D-", "G-", "C-"),
+    "minor": ("A", "E", "B", "F#", "C#", "G#", "D#", "A#", "D", "G", "C", "F", "B-", "E-", "A-"),
+}
+
 
 def find_musicxml_files(root: Path) -> list[Path]:
     xml_files: list[Path] = []
@@ -68,11 +97,91 @@ def chord_to_degree(
     return None
 
 
+def pitch_class_mask(pitch_classes: Iterable[int]) -> int:
+    mask = 0
+    for pc in pitch_classes:
+        mask |= 1 << pc
+    return mask
+
+
+def mask_to_degree(
+    chord_mask: int,
+    triad_masks: dict[int, int],
+    scale_mask: int,
+) -> int | None:
+    if not chord_mask:
+        return None
+    if chord_mask & ~scale_mask:
+        return None
+    for degree, triad_mask in triad_masks.items():
+        if triad_mask & chord_mask == triad_mask:
+            return degree
+    return None
+
+
+def _measure_note_spans(meas: stream.Measure) -> Iterator[tuple[float, float, int]]:
+    containers: list[tuple[float, stream.Stream]] = [(0.0, meas)]
+    containers.extend((voice.offset, voice) for voice in meas.voices)
+    for base_offset, container in containers:
+        for n in container.notes:
+            start = common.opFrac(base_offset + n.offset)
+            end = common.opFrac(start + n.quarterLength)
+            yield start, end, pitch_class_mask(p.pitchClass for p in getattr(n, "pitches", ()))
+
+
+def _slice_masks(spans: list[tuple[float, float, int]]) -> list[int]:
+    # Same vertical slices chordify would produce: one per span between consecutive onsets/releases.
+    # Grace notes have no duration and sound in the slice that starts at their offset.
+    boundaries = sorted({offset for start, end, _ in spans for offset in (start, end)})
+    masks: list[int] = []
+    for left in boundaries[:-1]:
+        mask = 0
+        for start, end, pcs in spans:
+            if start <= left < end or start == left == end:
+                mask |= pcs
+        masks.append(mask)
+    return masks
+
+
+def collect_measure_degrees_fast(
+    score: stream.Score,
+    triads: dict[int, set[int]],
+    scale_pcs: set[int],
+) -> dict[int, int | None]:
+    triad_masks = {degree: pitch_class_mask(pcs) for degree, pcs in triads.items()}
+    scale_mask = pitch_class_mask(scale_pcs)
+    measure_spans: dict[int, list[tuple[float, float, int]]] = {}
+    for part in score.parts:
+        # A repeated measure number keeps only its last occurrence, as the chordify path does.
+        part_spans: dict[int, list[tuple[float, float, int]]] = {}
+        for meas in part.getElementsByClass(stream.Measure):
+            num = meas.number
+            if num is None:
+                continue
+            part_spans[num] = list(_measure_note_spans(meas))
+        for num, spans in part_spans.items():
+            measure_spans.setdefault(num, []).extend(spans)
+
+    measure_degrees: dict[int, int | None] = {}
+    for num in sorted(measure_spans):
+        degree = None
+        for mask in _slice_masks(measure_spans[num]):
+            mapped = mask_to_degree(mask, triad_masks, scale_mask)
+            if mapped is not None:
+                degree = mapped
+                break
+        measure_degrees[num] = degree
+    return measure_degrees
+
+
 def collect_measure_degrees(
     score: stream.Score,
     triads: dict[int, set[int]],
     scale_pcs: set[int],
+    fast: bool = False,
 ) -> dict[int, int | None]:
+    if fast:
+        return collect_measure_degrees_fast(score, triads, scale_pcs)
     measure_degrees: dict[int, int | None] = {}
     chordified = score.chordify()
     for meas in chordified.getElementsByClass(stream.Measure):
@@ -100,12 +209,12 @@ def degree_to_roman_and_function(degree: int, mode: str) -> tuple[str, str] | No
     return roman, function
 
 
-def extract_progressions(score: stream.Score, source: Path) -> list[dict]:
+def extract_progressions(score: stream.Score, source: Path, fast_harmony: bool = False) -> list[dict]:
     key_obj = analyze_key(score)
     mode = key_obj.mode
     triads = build_diatonic_triads(key_obj)
     scale_pcs = build_scale_pitch_classes(key_obj)
-    measure_degrees = collect_measure_degrees(score, triads, scale_pcs)
+    measure_degrees = collect_measure_degrees(score, triads, scale_pcs, fast=fast_harmony)
     ordered_measures = sorted(measure_degrees.keys())
 
     progressions: list[dict] = []
@@ -216,6 +325,10 @@ EMOTIONAL_PROFILE = [
 ]
 
 
+EMOTION_IDS = [profile["emotion_id"] for profile in EMOTIONAL_PROFILE]
+FUNCTION_CODES = {"T": 0, "PD": 1, "D": 2}
+
+
 def _cadence_strength(function_seq: list[str]) -> float:
     if len(function_seq) < 2:
         return 0.0
@@ -292,25 +405,266 @@ def score_emotions(roman_seq: list[str], function_seq: list[str], mode: str) ->
     return {k: round(v / total, 4) for k, v in clipped_scores.items()}
 
 
-def collect_all_progressions(root: Path) -> list[dict]:
-    all_progressions: list[dict] = []
-    for xml_file in find_musicxml_files(root):
-        try:
-            score = converter.parse(str(xml_file))
-        except Exception:
+def _encode_sequences(
+    sequences: list[list[str]],
+    codes: dict[str, int],
+) -> tuple[np.ndarray, np.ndarray]:
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    width = int(lengths.max()) if len(sequences) else 0
+    flat = [codes.setdefault(symbol, len(codes)) for seq in sequences for symbol in seq]
+    if len(flat) == width * len(sequences):
+        return np.array(flat, dtype=np.int16).reshape(len(sequences), width), lengths
+    encoded = np.full((len(sequences), width), -1, dtype=np.int16)
+    mask = np.arange(width) < lengths[:, None]
+    encoded[mask] = flat
+    return encoded, lengths
+
+
+def _round_like_python(values: np.ndarray, ndigits: int) -> np.ndarray:
+    # np.round scales by 10**ndigits and can land on the other side of a tie from round();
+    # windows only produce a handful of distinct values, so round those with Python instead.
+    unique, inverse = np.unique(values.ravel(), return_inverse=True)
+    rounded = np.array([round(value, ndigits) for value in unique.tolist()], dtype=np.float64)
+    return rounded[inverse.ravel()].reshape(values.shape)
+
+
+def score_emotions_batch(
+    roman_seqs: list[list[str]],
+    function_seqs: list[list[str]],
+    modes: list[str],
+) -> np.ndarray:
+    functions, lengths = _encode_sequences(function_seqs, dict(FUNCTION_CODES))
+    roman_codes: dict[str, int] = {"vii°": 0}
+    romans, _ = _encode_sequences(roman_seqs, roman_codes)
+
+    # Two columns of left padding let empty and single-chord windows index their "last two" functions.
+    rows = np.arange(len(function_seqs))
+    padded = np.concatenate([np.full((len(function_seqs), 2), -1, dtype=np.int16), functions], axis=1)
+    last = padded[rows, lengths + 1]
+    second_last = padded[rows, lengths]
+
+    tonic_count = (functions == FUNCTION_CODES["T"]).sum(axis=1)
+    predominant_count = (functions == FUNCTION_CODES["PD"]).sum(axis=1)
+    dominant_count = (functions == FUNCTION_CODES["D"]).sum(axis=1)
+    ending_tonic = last == FUNCTION_CODES["T"]
+    ending_dominant = last == FUNCTION_CODES["D"]
+    has_diminished = (romans == roman_codes["vii°"]).any(axis=1)
+    cadence = np.where(
+        ending_tonic & (second_last == FUNCTION_CODES["D"]),
+        1.0,
+        np.where(ending_tonic & (lengths > 1), 0.5, 0.0),
+    )
+    mode_array = np.asarray(modes, dtype=object)
+    major_mode = mode_array == "major"
+    minor_mode = mode_array == "minor"
+
+    # Same terms, in the same order, as score_emotions so every float matches bit for bit.
+    raw_scores = np.empty((len(function_seqs), len(EMOTION_IDS)), dtype=np.float64)
+    raw_scores[:, 0] = (
+        0.5 * dominant_count
+        + np.where(ending_dominant, 1.0, 0.0)
+        + np.where(has_diminished, 0.5, 0.0)
+        - 0.2 * tonic_count
+    )
+    raw_scores[:, 1] = (
+        0.6 * tonic_count
+        + 0.3 * predominant_count
+        + np.where(ending_tonic, 0.5, 0.0)
+        - 0.4 * dominant_count
+        - np.where(has_diminished, 0.3, 0.0)
+    )
+    raw_scores[:, 2] = (
+        np.where(minor_mode, 1.0, 0.2)
+        + 0.2 * predominant_count
+        + np.where(ending_tonic, 0.2, 0.0)
+        - 0.2 * dominant_count
+    )
+    raw_scores[:, 3] = (
+        np.where(major_mode, 1.0, 0.0)
+        + 0.4 * dominant_count
+        + 0.6 * cadence
+        - 0.2 * predominant_count
+    )
+    raw_scores[:, 4] = (
+        0.3 * tonic_count
+        + 0.2 * predominant_count
+        + np.where(ending_tonic, 0.3, 0.0)
+        + np.where(minor_mode, 0.3, 0.1)
+        - 0.3 * dominant_count
+    )
+    raw_scores[:, 5] = (
+        np.where(minor_mode, 1.0, 0.0)
+        + np.where(has_diminished, 0.6, 0.0)
+        + 0.2 * dominant_count
+        - 0.2 * tonic_count
+    )
+    raw_scores[:, 6] = (
+        np.where(major_mode, 1.0, 0.0)
+        + 0.4 * tonic_count
+        + 0.3 * cadence
+        - 0.3 * dominant_count
+        - np.where(has_diminished, 0.2, 0.0)
+    )
+
+    clipped_scores = np.maximum(raw_scores, 0.0)
+    total = np.zeros(len(function_seqs), dtype=np.float64)
+    for column in range(clipped_scores.shape[1]):
+        total += clipped_scores[:, column]
+    normalized = np.divide(
+        clipped_scores,
+        total[:, None],
+        out=np.zeros_like(clipped_scores),
+        where=total[:, None] != 0,
+    )
+    equal = 1.0 / len(EMOTION_IDS)
+    return np.where(total[:, None] == 0, equal, _round_like_python(normalized, 4))
+
+
+def _timed_extract(xml_file: Path, fast_harmony: bool = False) -> tuple[Path, list[dict] | None, float]:
+    started = time.perf_counter()
+    try:
+        score = converter.parse(str(xml_file))
+    except Exception:
+        return xml_file, None, time.perf_counter() - started
+    progressions = extract_progressions(score, xml_file, fast_harmony=fast_harmony)
+    return xml_file, progressions, time.perf_counter() - started
+
+
+def iter_file_progressions(
+    xml_files: list[Path],
+    workers: int = 1,
+    fast_harmony: bool = False,
+) -> Iterator[tuple[Path, list[dict] | None, float]]:
+    # Results are yielded in input order so the pooled path matches the serial one.
+    extract = partial(_timed_extract, fast_harmony=fast_harmony)
+    if workers <= 1:
+        for xml_file in xml_files:
+            yield extract(xml_file)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(extract, xml_files)
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_entry_path(cache_dir: Path, digest: str, fast_harmony: bool = False) -> Path:
+    harmony_path = "fast" if fast_harmony else "chordify"
+    return cache_dir / f"{digest}.v{EXTRACTOR_VERSION}.{harmony_path}.json"
+
+
+def load_cached_progressions(entry_path: Path, source: Path) -> list[dict] | None:
+    with entry_path.open("r", encoding="utf-8") as handle:
+        progressions = json.load(handle)["progressions"]
+    if progressions is None:
+        return None
+    # Entries are keyed by content, so a moved or copied score reuses them under its current path.
+    for prog in progressions:
+        prog["source_file"] = str(source)
+    return progressions
+
+
+def store_cached_progressions(entry_path: Path, progressions: list[dict] | None) -> None:
+    tmp_path = entry_path.with_name(entry_path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as handle:
+        json.dump({"extractor_version": EXTRACTOR_VERSION, "progressions": progressions}, handle)
+    os.replace(tmp_path, entry_path)
+
+
+def prune_cache(cache_dir: Path, live_entries: set[Path], fast_harmony: bool = False) -> int:
+    # Only entries of this run's extractor version and harmony path are candidates, so a
+    # --fast-harmony run leaves the chordify entries alone and the other way round.
+    removed = 0
+    for entry_path in cache_dir.glob(cache_entry_path(Path(), "*", fast_harmony).name):
+        if entry_path not in live_entries:
+            entry_path.unlink()
+            removed += 1
+    return removed
+
+
+def iter_all_progressions(
+    root: Path,
+    workers: int = 1,
+    cache_dir: Path | None = None,
+    fast_harmony: bool = False,
+    shard: tuple[int, int] | None = None,
+) -> Iterator[list[dict]]:
+    xml_files = find_musicxml_files(root)
+    if shard is not None:
+        shard_index, shard_count = shard
+        xml_files = xml_files[shard_index::shard_count]
+
+    entry_paths: dict[Path, Path] = {}
+    pending: list[Path] = []
+    if cache_dir is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    for xml_file in xml_files:
+        if cache_dir is not None:
+            try:
+                entry_paths[xml_file] = cache_entry_path(cache_dir, file_digest(xml_file), fast_harmony)
+            except OSError:
+                pass
+        entry_path = entry_paths.get(xml_file)
+        if entry_path is None or not entry_path.exists():
+            pending.append(xml_file)
+
+    failed = 0
+    cached = 0
+    pending_files = set(pending)
+    parsed = iter_file_progressions(pending, workers, fast_harmony)
+    for xml_file in xml_files:
+        entry_path = entry_paths.get(xml_file)
+        if xml_file in pending_files:
+            _, progressions, elapsed = next(parsed)
+            label = f"{elapsed:7.2f}s"
+            if entry_path is not None:
+                store_cached_progressions(entry_path, progressions)
+        else:
+            progressions = load_cached_progressions(entry_path, xml_file)
+            label = " cached "
+            cached += 1
+        if progressions is None:
+            failed += 1
+            print(f"[{label}] {xml_file}: parse failed")
             continue
-        all_progressions.extend(extract_progressions(score, xml_file))
+        print(f"[{label}] {xml_file}: {len(progressions)} progressions")
+        yield progressions
+
+    if cache_dir is not None:
+        # A shard only sees part of the corpus, so it must not prune the other shards' entries.
+        removed = prune_cache(cache_dir, set(entry_paths.values()), fast_harmony) if shard is None else 0
+        print(f"Reused {cached} cached extractions, dropped {removed} stale cache entries")
+    print(f"Parsed {len(xml_files) - failed}/{len(xml_files)} files ({failed} failed)")
+
+
+def collect_all_progressions(
+    root: Path,
+    workers: int = 1,
+    cache_dir: Path | None = None,
+    fast_harmony: bool = False,
+) -> list[dict]:
+    all_progressions: list[dict] = []
+    for progressions in iter_all_progressions(root, workers, cache_dir, fast_harmony):
+        all_progressions.extend(progressions)
     return all_progressions
 
 
 def build_emotion_scores(progressions: list[dict]) -> list[dict]:
+    if not progressions:
+        return []
+    score_rows = score_emotions_batch(
+        [prog["roman_sequence"] for prog in progressions],
+        [prog["function_sequence"] for prog in progressions],
+        [prog["mode"] for prog in progressions],
+    ).tolist()
     scored: list[dict] = []
-    for prog in progressions:
-        scores = score_emotions(
-            prog["roman_sequence"],
-            prog["function_sequence"],
-            prog["mode"],
-        )
+    for prog, row in zip(progressions, score_rows):
+        scores = dict(zip(EMOTION_IDS, row))
         scored.append({
             "source_file": prog["source_file"],
             "key": prog["key"],
@@ -324,11 +678,16 @@ def build_emotion_scores(progressions: list[dict]) -> list[dict]:
     return scored
 
 
-def update_progression_weights(records: list[dict]) -> list[dict]:
+def count_roman_sequences(records: Iterable[dict]) -> dict[tuple[str, ...], int]:
     counts: dict[tuple[str, ...], int] = {}
     for item in records:
         seq = tuple(item.get("roman_sequence", []))
         counts[seq] = counts.get(seq, 0) + 1
+    return counts
+
+
+def update_progression_weights(records: list[dict]) -> list[dict]:
+    counts = count_roman_sequences(records)
     max_count = max(counts.values()) if counts else 1
     print("max count", max_count)
     for item in records:
@@ -338,66 +697,302 @@ def update_progression_weights(records: list[dict]) -> list[dict]:
     return records
 
 
-def update_weights_file(path: Path) -> None:
+def iter_jsonl(path: Path) -> Iterator[dict]:
     with path.open("r", encoding="utf-8") as handle:
-        records = json.load(handle)
-    update_progression_weights(records)
-    with path.open("w", encoding="utf-8") as handle:
-        json.dump(records, handle, indent=2)
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
 
 
-def build_progression_pattern_summary(records: list[dict]) -> list[dict]:
-    counts: dict[tuple[str, str, tuple[str, ...]], int] = {}
-    emotion_sums: dict[tuple[str, str, tuple[str, ...]], dict[str, float]] = {}
-    for item in records:
+def write_progression_weights(path: Path, counts: dict[tuple[str, ...], int]) -> None:
+    max_count = max(counts.values()) if counts else 1
+    print("max count", max_count)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as handle:
+        for item in iter_jsonl(path):
+            count = counts.get(tuple(item.get("roman_sequence", [])), 0)
+            item["weight"] = round(count / max_count, 4)
+            handle.write(json.dumps(item) + "\n")
+    os.replace(tmp_path, path)
+
+
+def update_weights_file(path: Path) -> None:
+    # Two streaming passes over the JSONL file: count patterns, then rewrite weights line by line.
+    write_progression_weights(path, count_roman_sequences(iter_jsonl(path)))
+
+
+def _fixed_point(score: float) -> int:
+    return round(math.ldexp(float(score), SUM_SCALE_BITS))
+
+
+class PatternSummaryAggregator:
+    def __init__(self) -> None:
+        self.counts: dict[tuple[str, tuple[str, ...], tuple[str, ...]], int] = {}
+        self.emotion_sums: dict[tuple[str, tuple[str, ...], tuple[str, ...]], dict[str, int]] = {}
+        self.first_seen: dict[tuple[str, tuple[str, ...], tuple[str, ...]], tuple[str, int]] = {}
+        self.roman_counts: dict[tuple[str, ...], int] = {}
+
+    def add(self, item: dict) -> None:
         roman_seq = tuple(item.get("roman_sequence", []))
         function_seq = item.get("function_sequence", [])
         mode = item.get("mode", "")
         key = (mode, roman_seq, tuple(function_seq))
-        counts[key] = counts.get(key, 0) + 1
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.roman_counts[roman_seq] = self.roman_counts.get(roman_seq, 0) + 1
+        if key not in self.first_seen:
+            self.first_seen[key] = (item.get("source_file", ""), item.get("start_measure", 0))
         emotion_scores = item.get("emotion_scores", {})
-        if key not in emotion_sums:
-            emotion_sums[key] = {k: 0.0 for k in emotion_scores}
+        if key not in self.emotion_sums:
+            self.emotion_sums[key] = {k: 0 for k in emotion_scores}
+        sums = self.emotion_sums[key]
         for emotion_id, score in emotion_scores.items():
-            emotion_sums[key][emotion_id] = emotion_sums[key].get(emotion_id, 0.0) + float(score)
+            sums[emotion_id] = sums.get(emotion_id, 0) + _fixed_point(score)
+
+    def merge_partial(self, partial_summary: dict) -> None:
+        if partial_summary.get("format") != PARTIAL_SUMMARY_FORMAT:
+            raise ValueError("not a partial progression pattern summary")
+        if partial_summary.get("version") != PARTIAL_SUMMARY_VERSION:
+            raise ValueError(f"unsupported partial summary version {partial_summary.get('version')}")
+        if partial_summary.get("sum_scale_bits") != SUM_SCALE_BITS:
+            raise ValueError(f"partial summary uses sum_scale_bits={partial_summary.get('sum_scale_bits')}")
+        for pattern in partial_summary["patterns"]:
+            key = (pattern["mode"], tuple(pattern["roman_sequence"]), tuple(pattern["function_sequence"]))
+            self.counts[key] = self.counts.get(key, 0) + pattern["count"]
+            roman_seq = key[1]
+            self.roman_counts[roman_seq] = self.roman_counts.get(roman_seq, 0) + pattern["count"]
+            first_seen = (pattern["first_seen"][0], pattern["first_seen"][1])
+            if key not in self.first_seen or _first_seen_order(first_seen) < _first_seen_order(self.first_seen[key]):
+                self.first_seen[key] = first_seen
+            sums = self.emotion_sums.setdefault(key, {})
+            for emotion_id, total in pattern["emotion_sums"].items():
+                sums[emotion_id] = sums.get(emotion_id, 0) + total
+
+    def to_partial(self) -> dict:
+        return {
+            "format": PARTIAL_SUMMARY_FORMAT,
+            "version": PARTIAL_SUMMARY_VERSION,
+            "sum_scale_bits": SUM_SCALE_BITS,
+            "patterns": [
+                {
+                    "roman_sequence": list(roman_seq),
+                    "mode": mode,
+                    "function_sequence": list(function_seq),
+                    "count": count,
+                    "emotion_sums": self.emotion_sums.get((mode, roman_seq, function_seq), {}),
+                    "first_seen": list(self.first_seen[(mode, roman_seq, function_seq)]),
+                }
+                for (mode, roman_seq, function_seq), count in self.counts.items()
+            ],
+        }
+
+    def summary(self) -> list[dict]:
+        max_count = max(self.counts.values()) if self.counts else 1
+        scale = 1 << SUM_SCALE_BITS
+        # Patterns are listed in corpus order of first occurrence, however the corpus was sharded.
+        ordered_keys = sorted(self.counts, key=lambda key: _first_seen_order(self.first_seen[key]))
+        summary: list[dict] = []
+        for mode, roman_seq, function_seq in ordered_keys:
+            count = self.counts[(mode, roman_seq, function_seq)]
+            averaged_emotions: dict[str, float] = {}
+            sums = self.emotion_sums.get((mode, roman_seq, function_seq), {})
+            for emotion_id, total in sums.items():
+                averaged_emotions[emotion_id] = round(total / scale / count, 4)
+            summary.append({
+                "roman_sequence": list(roman_seq),
+                "mode": mode,
+                "function_sequence": list(function_seq),
+                "count": count,
+                "base_weight": round(count / max_count, 4),
+                "emotion_scores": averaged_emotions,
+            })
+        return summary
+
+
+def _first_seen_order(first_seen: tuple[str, int]) -> tuple[Path, int]:
+    # find_musicxml_files sorts Path objects, so compare sources as paths rather than strings.
+    source_file, start_measure = first_seen
+    return Path(source_file), start_measure
+
+
+def build_progression_pattern_summary(records: Iterable[dict]) -> list[dict]:
+    aggregator = PatternSummaryAggregator()
+    for item in records:
+        aggregator.add(item)
+    return aggregator.summary()
 
-    max_count = max(counts.values()) if counts else 1
-    summary: list[dict] = []
-    for (mode, roman_seq, function_seq), count in counts.items():
-        averaged_emotions: dict[str, float] = {}
-        sums = emotion_sums.get((mode, roman_seq, function_seq), {})
-        for emotion_id, total in sums.items():
-            averaged_emotions[emotion_id] = round(total / count, 4)
-        summary.append({
-            "roman_sequence": list(roman_seq),
-            "mode": mode,
-            "function_sequence": list(function_seq),
-            "count": count,
-            "base_weight": round(count / max_count, 4),
-            "emotion_scores": averaged_emotions,
-        })
-    return summary
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract chord progression patterns from a MusicXML corpus.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to parse scores (default: 1, serial)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help=f"directory for cached per-file extractions (default: ./{CACHE_DIR_NAME})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="reparse every score and leave the extraction cache untouched",
+    )
+    parser.add_argument(
+        "--fast-harmony",
+        action="store_true",
+        help="read measure harmony from per-measure pitch-class bitmasks instead of chordify",
+    )
+    parser.add_argument(
+        "--shard",
+        type=_parse_shard,
+        default=None,
+        metavar="INDEX/COUNT",
+        help="only ingest every COUNT-th score starting at INDEX (requires --partial)",
+    )
+    parser.add_argument(
+        "--partial",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="write a mergeable partial summary to PATH instead of progression_pattern_summary.json",
+    )
+    parser.add_argument(
+        "--merge",
+        type=Path,
+        nargs="+",
+        default=None,
+        metavar="PARTIAL",
+        help="merge partial summaries into progression_pattern_summary.json without ingesting scores",
+    )
+    parser.add_argument(
+        "--store-only",
+        action="store_true",
+        help=f"only convert progression_pattern_summary.json into ./{PATTERN_STORE_PATH}",
+    )
+    parser.add_argument(
+        "--voicings-only",
+        action="store_true",
+        help=f"only rebuild the chord voicing table at ./{VOICING_TABLE_PATH}",
+    )
+    args = parser.parse_args()
+    if args.shard is not None and args.partial is None:
+        parser.error("--shard requires --partial; merge the partial summaries with --merge")
+    return args
 
 
-def main() -> None:
-    root = Path.cwd()
+def merge_partial_summaries(paths: list[Path]) -> list[dict]:
+    aggregator = PatternSummaryAggregator()
+    for path in paths:
+        with path.open("r", encoding="utf-8") as handle:
+            aggregator.merge_partial(json.load(handle))
+    return aggregator.summary()
+
+
+def write_pattern_summary(pattern_summary: list[dict], path: Path) -> None:
+    # JSON stays the interchange format; generation loads the binary store written beside it.
+    with path.open("w", encoding="utf-8") as handle:
+        json.dump(pattern_summary, handle, indent=2)
+    write_pattern_store(pattern_summary, path.with_name(PATTERN_STORE_PATH.name))
+
+
+def build_voicing_table() -> dict[str, dict[str, list[int]]]:
+    # MIDI notes for every chord generation can ask for: each scale-degree numeral the
+    # extractor emits, with each extension choose_extension may add to it, in each key.
+    table: dict[str, dict[str, list[int]]] = {}
+    for mode, tonics in VOICING_TONICS.items():
+        labelled = filter(None, (degree_to_roman_and_function(degree, mode) for degree in range(1, 8)))
+        numerals = [
+            f"{numeral}{extension}"
+            for numeral, function in labelled
+            for extension in extension_labels(numeral, function)
+        ]
+        for tonic in tonics:
+            key_signature = m21key.Key(tonic, mode)
+            chords = table[voicing_table_key(tonic, mode)] = {}
+            for numeral in numerals:
+                rn = roman.RomanNumeral(numeral, key_signature)
+                for p in rn.pitches:
+                    p.octave = VOICING_OCTAVE
+                chords[numeral] = [p.midi for p in rn.pitches]
+    return table
+
+
+def write_voicing_table(path: Path) -> int:
+    table = build_voicing_table()
+    with path.open("w", encoding="utf-8") as handle:
+        json.dump({"version": VOICING_TABLE_VERSION, "octave": VOICING_OCTAVE, "keys": table}, handle, separators=(",", ":"))
+    return sum(len(chords) for chords in table.values())
+
 
-    progressions = collect_all_progressions(root)
+def _parse_shard(value: str) -> tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected INDEX/COUNT, e.g. 0/4") from None
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count})")
+    return index, count
 
-    emotion_scores = build_emotion_scores(progressions)
-    update_progression_weights(emotion_scores)
-    emotion_scores_path = root / "chord_progression_with_emotion_score.json"
-    with emotion_scores_path.open("w", encoding="utf-8") as handle:
-        json.dump(emotion_scores, handle, indent=2)
 
-    pattern_summary = build_progression_pattern_summary(emotion_scores)
+def main() -> None:
+    args = parse_args()
+    root = Path.cwd()
     pattern_summary_path = root / "progression_pattern_summary.json"
-    with pattern_summary_path.open("w", encoding="utf-8") as handle:
-        json.dump(pattern_summary, handle, indent=2)
+    voicing_table_path = root / VOICING_TABLE_PATH
+
+    if args.store_only:
+        with pattern_summary_path.open("r", encoding="utf-8") as handle:
+            pattern_summary = json.load(handle)
+        write_pattern_store(pattern_summary, root / PATTERN_STORE_PATH)
+        print(f"Wrote {len(pattern_summary)} patterns to {root / PATTERN_STORE_PATH}")
+        return
+
+    if args.voicings_only:
+        chord_count = write_voicing_table(voicing_table_path)
+        print(f"Wrote {chord_count} chord voicings to {voicing_table_path}")
+        return
+
+    if args.merge:
+        pattern_summary = merge_partial_summaries(args.merge)
+        write_pattern_summary(pattern_summary, pattern_summary_path)
+        write_voicing_table(voicing_table_path)
+        print(f"Merged {len(args.merge)} partial summaries into {len(pattern_summary)} patterns at {pattern_summary_path}")
+        return
+
+    cache_dir = None if args.no_cache else (args.cache_dir or root / CACHE_DIR_NAME)
+
+    # Scored windows are streamed to JSONL as files finish; only per-pattern aggregates stay in memory.
+    aggregator = PatternSummaryAggregator()
+    scored_count = 0
+    # A shard's weights would only count its own slice of the corpus, so shards skip the JSONL.
+    emotion_scores_path = None if args.shard is not None else root / "chord_progression_with_emotion_score.jsonl"
+    with emotion_scores_path.open("w", encoding="utf-8") if emotion_scores_path else contextlib.nullcontext() as handle:
+        for progressions in iter_all_progressions(root, args.workers, cache_dir, args.fast_harmony, args.shard):
+            for record in build_emotion_scores(progressions):
+                aggregator.add(record)
+                if handle is not None:
+                    handle.write(json.dumps(record) + "\n")
+                scored_count += 1
+    if emotion_scores_path is not None:
+        write_progression_weights(emotion_scores_path, aggregator.roman_counts)
+
+    if args.partial:
+        with args.partial.open("w", encoding="utf-8") as handle:
+            json.dump(aggregator.to_partial(), handle)
+        scores_note = f" to {emotion_scores_path}" if emotion_scores_path is not None else ""
+        print(f"Scored {scored_count} progressions{scores_note}, wrote partial summary to {args.partial}")
+        return
+
+    pattern_summary = aggregator.summary()
+    write_pattern_summary(pattern_summary, pattern_summary_path)
+    write_voicing_table(voicing_table_path)
 
     print(
         "Wrote "
-        f"{len(emotion_scores)} scored progressions to {emotion_scores_path}, "
+        f"{scored_count} scored progressions to {emotion_scores_path}, "
         f"{len(pattern_summary)} progression patterns to {pattern_summary_path}"
     )
 
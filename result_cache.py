@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from chord_generation_model import GeneratedProgression
+
+# Bump whenever the layout of cached entries changes. Sampling code changes are covered by the
+# fingerprint from open_result_cache, which hashes the generation modules' sources.
+RESULT_CACHE_VERSION = 1
+DEFAULT_CACHE_SIZE = 4096
+
+
+def data_fingerprint(paths: list[Path], *extra: object) -> str:
+    # Hash of every input file that exists plus any settings that shape the output, so cached
+    # results are never served against different data.
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(str(path.name).encode("utf-8"))
+        if path.exists():
+            digest.update(hashlib.sha256(path.read_bytes()).digest())
+    digest.update(json.dumps(extra, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # Generated progressions and their MIDI, addressed by a hash of everything that determines
+    # them: the data fingerprint, the emotion bias, the seed and the tempo. Entries live in an
+    # in-memory LRU and, with a directory, on disk where other processes can share them.
+
+    def __init__(self, fingerprint: str, directory: Path | None = None, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.fingerprint = fingerprint
+        self.directory = directory
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[GeneratedProgression, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, emotion_bias: dict[str, float], seed: int, bpm: int) -> str:
+        payload = [RESULT_CACHE_VERSION, self.fingerprint, sorted(emotion_bias.items()), seed, bpm]
+        return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        folder = self.directory / key[:2]
+        return folder / f"{key}.json", folder / f"{key}.mid"
+
+    def get(self, key: str) -> tuple[GeneratedProgression, bytes] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        if self.directory is not None:
+            json_path, midi_path = self._paths(key)
+            try:
+                entry = (json.loads(json_path.read_text(encoding="utf-8")), midi_path.read_bytes())
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                with self._lock:
+                    self.hits += 1
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, progression: GeneratedProgression, midi: bytes) -> None:
+        self._remember(key, (progression, midi))
+        if self.directory is None:
+            return
+        json_path, midi_path = self._paths(key)
+        json_path.parent.mkdir(exist_ok=True)
+        # MIDI first, so a reader that finds the JSON always finds its MIDI too.
+        for path, data in ((midi_path, midi), (json_path, json.dumps(progression).encode("utf-8"))):
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                tmp_path.unlink(missing_ok=True)
+                return
+
+    def _remember(self, key: str, entry: tuple[GeneratedProgression, bytes]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self.max_size}
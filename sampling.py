@@ -0,0 +1,61 @@
+import random
+from collections.abc import Sequence
+
+import numpy as np
+
+# Every sampler takes an optional random.Random and falls back to the module-level generator.
+# Callers that need reproducible or thread-safe draws pass their own instance.
+
+
+class AliasSampler:
+    # Walker/Vose alias table: O(n) to build, O(1) per draw. Meant for distributions that
+    # stay fixed between requests, such as key profiles or fallback base weights.
+
+    def __init__(self, weights: Sequence[float] | np.ndarray) -> None:
+        scaled = np.clip(np.asarray(weights, dtype=np.float64), 0.0, None)
+        total = scaled.sum()
+        if not len(scaled) or total <= 0:
+            raise ValueError("AliasSampler needs at least one positive weight")
+        scaled = (scaled * (len(scaled) / total)).tolist()
+
+        probability = [1.0] * len(scaled)
+        alias = list(range(len(scaled)))
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            lesser = small.pop()
+            greater = large[-1]
+            probability[lesser] = scaled[lesser]
+            alias[lesser] = greater
+            scaled[greater] = (scaled[greater] + scaled[lesser]) - 1.0
+            if scaled[greater] < 1.0:
+                small.append(large.pop())
+        # Whatever is left over only differs from 1.0 by rounding error.
+
+        self._probability = probability
+        self._alias = alias
+        self._size = len(probability)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def sample(self, rng: random.Random | None = None) -> int:
+        scaled = (rng or random).random() * self._size
+        column = int(scaled)
+        if scaled - column < self._probability[column]:
+            return column
+        return self._alias[column]
+
+
+def weighted_pick(weights: np.ndarray, rng: random.Random | None = None) -> int:
+    # Fast path for weights that change per request, where building an alias table would
+    # cost as much as the draw. Same draw as random.choices: one random() bisected into
+    # the running total.
+    return pick_cumulative(np.cumsum(weights), rng)
+
+
+def pick_cumulative(cumulative: np.ndarray, rng: random.Random | None = None) -> int:
+    # weighted_pick for callers that keep the running total of a reused distribution.
+    position = int(np.searchsorted(cumulative, (rng or random).random() * cumulative[-1], side="right"))
+    return min(position, len(cumulative) - 1)
+
@@ -1,5 +1,16 @@
-from chord_generation_model import ProgressionSummary
 import random
+import threading
+from bisect import bisect
+from collections import OrderedDict, deque
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+from itertools import accumulate
+
+import numpy as np
+
+from chord_generation_model import DOMINANT_FUNCTION, FUNCTIONS, NUMERALS, TONIC_FUNCTION, PatternRecord
+from pattern_index import PatternIndex, PatternSubset
+from sampling import pick_cumulative
 
 SECTION_CONFIG = {
   "intro": {
@@ -28,6 +39,14 @@ SECTION_CONFIG = {
   }
 }
 
+# How many preceding sections' progressions a section may not repeat.
+AVOID_LAST_SECTIONS = 1
+# Redraws of an excluded pick before the non-excluded candidates are weighted on their own.
+MAX_EXCLUDED_REDRAWS = 8
+
+EXTENSION_TABLE_CACHE_SIZE = 4096
+EXTENSION_CLASSES = ("D", "upper", "lower", "other")
+
 def _emotion_axes(emotion_bias: dict[str, float]) -> dict[str, float]:
     suspenseful_tense = float(emotion_bias.get("suspenseful_tense", 0.0))
     calm_meditative = float(emotion_bias.get("calm_meditative", 0.0))
@@ -53,28 +72,23 @@ def _emotion_axes(emotion_bias: dict[str, float]) -> dict[str, float]:
     }
 
 
-def _weighted_choice(options: list[tuple[str, float]]) -> str:
-    labels = [label for label, _ in options]
-    weights = [max(weight, 0.0) for _, weight in options]
-    total = sum(weights)
-    if total == 0:
-        return labels[0]
-    return random.choices(labels, weights=weights, k=1)[0]
-
-
 def _apply_extension_to_roman(roman_seq: str, extension: str) -> str:
     if extension == "":
         return roman_seq
     return f"{roman_seq}{extension}"
 
 
-def choose_extension(
-    roman_seq: str,
-    function: str,
-    mode: str,
-    emotion_bias: dict[str, float],
-) -> str:
-    axes = _emotion_axes(emotion_bias)
+def _extension_class(roman_seq: str, function: str) -> str:
+    if function == "D":
+        return "D"
+    if roman_seq[:1].isupper():
+        return "upper"
+    if roman_seq[:1].islower():
+        return "lower"
+    return "other"
+
+
+def _class_extension_options(extension_class: str, axes: dict[str, float]) -> list[tuple[str, float]]:
     tension = axes["tension"]
     calm = axes["calm"]
     lift = axes["lift"]
@@ -82,20 +96,14 @@ def choose_extension(
     wistful = axes["wistful"]
     nostalgia = axes["nostalgia"]
 
-    if function == "D":
-        extension = _weighted_choice(
-            [
-                ("7", 1.0 + 0.5 * tension - 0.4 * calm),
-                ("9", 0.6 + 0.6 * lift + 0.2 * warmth - 0.3 * calm),
-                ("7b9", 0.2 + 1.2 * tension - 0.5 * calm),
-                ("7#9", 0.2 + 1.0 * tension - 0.5 * calm),
-                ("7#9b13", 0.1 + 1.4 * tension - 0.6 * calm),
-            ]
-        )
-        return _apply_extension_to_roman(roman_seq, extension)
-
-    is_upper = roman_seq[:1].isupper()
-    is_lower = roman_seq[:1].islower()
+    if extension_class == "D":
+        return [
+            ("7", 1.0 + 0.5 * tension - 0.4 * calm),
+            ("9", 0.6 + 0.6 * lift + 0.2 * warmth - 0.3 * calm),
+            ("7b9", 0.2 + 1.2 * tension - 0.5 * calm),
+            ("7#9", 0.2 + 1.0 * tension - 0.5 * calm),
+            ("7#9b13", 0.1 + 1.4 * tension - 0.6 * calm),
+        ]
 
     options: list[tuple[str, float]] = [
         ("", 1.1 + 0.8 * calm - 0.3 * tension),
@@ -103,90 +111,255 @@ def choose_extension(
         ("9", 0.2 + 0.6 * calm + 0.4 * warmth + 0.4 * lift - 0.2 * tension),
     ]
 
-    if is_lower:
+    if extension_class == "lower":
         options.append(("7", 0.4 + 0.6 * wistful + 0.3 * tension + 0.2 * warmth))
-    if is_upper:
+    if extension_class == "upper":
         options.append(("maj7", 0.3 + 0.8 * calm + 0.6 * nostalgia + 0.2 * lift - 0.2 * tension))
 
-    extension = _weighted_choice(options)
-    return _apply_extension_to_roman(roman_seq, extension)
+    return options
 
 
+def extension_options(roman_seq: str, function: str, axes: dict[str, float]) -> list[tuple[str, float]]:
+    return _class_extension_options(_extension_class(roman_seq, function), axes)
 
 
+@lru_cache(maxsize=EXTENSION_TABLE_CACHE_SIZE)
+def _extension_tables(emotion_bias_items: tuple[tuple[str, float], ...]) -> dict[str, tuple[tuple[str, ...], tuple[float, ...]]]:
+    # Labels and running totals of clamped weights for every chord class, from one set of axes.
+    axes = _emotion_axes(dict(emotion_bias_items))
+    tables = {}
+    for extension_class in EXTENSION_CLASSES:
+        options = _class_extension_options(extension_class, axes)
+        tables[extension_class] = (
+            tuple(label for label, _ in options),
+            tuple(accumulate(max(weight, 0.0) for _, weight in options)),
+        )
+    return tables
 
-def check_if_motion_in_range(section_attributes:dict, motion_penalty:float)->bool:
-    
-    min_motion = section_attributes.get('motion_min', 0.0)
-    max_motion = section_attributes.get('motion_max', 1.0)
 
-    return motion_penalty >= min_motion and motion_penalty <= max_motion
+def extension_labels(roman_seq: str, function: str) -> list[str]:
+    # Every extension choose_extension can return for this chord, whatever the bias.
+    return [label for label, _ in extension_options(roman_seq, function, _emotion_axes({}))]
 
-def check_if_dominant_valid(section_attributes:dict , function_seq:list[str])->bool:
-    max_dominant = section_attributes.get('dominant_max', len(function_seq))
-    min_dominant = section_attributes.get('dominant_min', 0)
 
-    dominant_count = 0
+def choose_extension(
+    roman_seq: str,
+    function: str,
+    mode: str,
+    emotion_bias: dict[str, float],
+    rng: random.Random | None = None,
+) -> str:
+    return choose_extensions([(roman_seq, function)], emotion_bias, rng)[0]
 
-    for seq in function_seq:
-        if seq == 'D':
-            dominant_count+=1
 
-    does_end_with_dom = function_seq[-1] == 'D'
+def choose_extensions(
+    chords: list[tuple[str, str]],
+    emotion_bias: dict[str, float],
+    rng: random.Random | None = None,
+) -> list[str]:
+    # Extends every (numeral, function) of a section in one pass over the bias's cached tables.
+    # Draws match random.choices: one random() per chord, bisected into the running totals,
+    # and none when every weight is zero.
+    tables = _extension_tables(tuple(emotion_bias.items()))
+    draw = (rng or random).random
+    extended = []
+    for roman_seq, function in chords:
+        labels, cumulative = tables[_extension_class(roman_seq, function)]
+        total = cumulative[-1] + 0.0
+        extension = labels[bisect(cumulative, draw() * total, 0, len(labels) - 1)] if total > 0 else labels[0]
+        extended.append(_apply_extension_to_roman(roman_seq, extension))
+    return extended
+
+
+def section_mask(pattern_index: PatternIndex, section_attributes: dict) -> np.ndarray:
+    # A section's motion range, dominant count and ending-function rules, over every pattern at once.
+    motion_penalty = pattern_index.motion_penalty
+    dominant_count = pattern_index.dominant_count
+
+    mask = (motion_penalty >= section_attributes.get('motion_min', 0.0)) & (motion_penalty <= section_attributes.get('motion_max', 1.0))
+    mask &= dominant_count <= section_attributes.get('dominant_max', pattern_index.sequence_length)
+    mask &= dominant_count >= section_attributes.get('dominant_min', 0)
 
     if "ending_dominant" in section_attributes:
-        if section_attributes["ending_dominant"] != does_end_with_dom:
-            return False
-
-    return dominant_count <= max_dominant and dominant_count >= min_dominant
-
-
-def check_if_tonic_valid(section_attributes:dict , last_function:str)->bool:
-    
-    does_end_with_tonic = last_function == 'T'
-
-    if section_attributes.get('ending_tonic') and section_attributes['ending_tonic'] != does_end_with_tonic:
-        return False
-    
-    return True
-
-
-def get_effective_weights(emotion_bias:dict[str, float] , progression_pattern_summary: list[ProgressionSummary], section_attributes:dict , exclude:list[str]):
-    result:list[float] = []
-    positive_weighted_pattern:list[ProgressionSummary] = []
-
-    for pattern in progression_pattern_summary:
-        pattern_emotion_score = pattern['emotion_scores']
-        emotion_score:float = 0.0
-        
-        for k in pattern_emotion_score.keys():
-            if k in emotion_bias:
-                emotion_score += (emotion_bias.get(k, 0.0) * pattern_emotion_score.get(k, 0.0))
-        
-        motion_penalty: float = len(set(pattern['roman_sequence'])) / len(pattern['roman_sequence'])
-
-        effective_weight:float = emotion_score * pattern['base_weight'] * motion_penalty
-
-            
-        is_motion_in_range = check_if_motion_in_range(section_attributes, motion_penalty)
-
-        is_dominant_valid = check_if_dominant_valid(section_attributes, pattern["function_sequence"])
-
-        is_tonic_valid = check_if_tonic_valid(section_attributes, pattern["function_sequence"][-1])
-
-
-        if effective_weight > 0 and is_motion_in_range and is_dominant_valid and is_tonic_valid and pattern["roman_sequence"] != exclude:
-            positive_weighted_pattern.append(pattern)
-            result.append(effective_weight)
-
-
-    return result , positive_weighted_pattern
-
-
-
-
-def get_chord_prog(section_attributes:dict , prompt_emotion_bias:dict , progression_pattern_summary : list[ProgressionSummary], exclude:list[str])->list[str]:
-   
+        mask &= (pattern_index.ending_function == DOMINANT_FUNCTION) == section_attributes["ending_dominant"]
+
+    if section_attributes.get('ending_tonic'):
+        mask &= pattern_index.ending_function == TONIC_FUNCTION
+
+    return mask
+
+
+def _constraint_key(section_attributes: dict) -> tuple:
+    return tuple(sorted((name, value) for name, value in section_attributes.items() if name != 'bias_delta'))
+
+
+def compile_section_constraints(pattern_index: PatternIndex, section_attributes: dict) -> PatternSubset:
+    key = _constraint_key(section_attributes)
+    if key not in pattern_index.subsets:
+        pattern_index.subsets[key] = pattern_index.subset(section_mask(pattern_index, section_attributes))
+    return pattern_index.subsets[key]
+
+
+def compile_sections(pattern_index: PatternIndex, section_config: dict = SECTION_CONFIG) -> None:
+    # Done once per index at load time; {} is the unconstrained fallback used by get_chord_prog.
+    for section_attributes in section_config.values():
+        compile_section_constraints(pattern_index, section_attributes)
+    compile_section_constraints(pattern_index, {})
+
+
+DEFAULT_BIAS_STEP = 0.01
+DEFAULT_DISTRIBUTION_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class DistributionLRU:
+    # Long-lived, size-bounded DistributionCache shared by every request of a process; the least
+    # recently used entries go once their arrays pass max_bytes. Entries hold only arrays allocated
+    # for them (weights, running totals and candidate positions), so the count is real memory. Callers run biases through
+    # quantize() first, so nearby biases share entries and a result depends only on the quantized
+    # bias, never on what happens to be cached.
+
+    def __init__(self, max_bytes: int = DEFAULT_DISTRIBUTION_CACHE_BYTES, bias_step: float = DEFAULT_BIAS_STEP) -> None:
+        self.max_bytes = max_bytes
+        self.bias_step = bias_step
+        self._entries: OrderedDict[tuple, tuple[np.ndarray, ...]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def quantize(self, emotion_bias: dict[str, float]) -> dict[str, float]:
+        if not self.bias_step:
+            return emotion_bias
+        return {emotion: round(round(value / self.bias_step) * self.bias_step, 10) for emotion, value in emotion_bias.items()}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._entries
+
+    def get(self, key: tuple) -> tuple[np.ndarray, ...] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def __setitem__(self, key: tuple, entry: tuple[np.ndarray, ...]) -> None:
+        size = sum(array.nbytes for array in entry)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= sum(array.nbytes for array in previous)
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= sum(array.nbytes for array in evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "bias_step": self.bias_step,
+            }
+
+
+# Candidate weights keyed by index, constraints and bias, plus the ready-to-sample running
+# totals of the same candidates. Nothing depends on the excluded sequences. A plain dict lives for one batch or prompt; a
+# DistributionLRU is shared for the life of the process.
+DistributionCache = dict[tuple, tuple[np.ndarray, ...]] | DistributionLRU
+
+
+def section_distribution(emotion_bias:dict[str, float] , pattern_index: PatternIndex, section_attributes:dict , distributions:DistributionCache | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Only the weights are cached; positions and sequence ids belong to the shared subset, so
+    # DistributionLRU's byte count covers just what each entry allocates.
+    eligible_patterns = compile_section_constraints(pattern_index, section_attributes)
+    key = (id(pattern_index), _constraint_key(section_attributes), tuple(emotion_bias.items()))
+    cached = distributions.get(key) if distributions is not None else None
+    if cached is not None:
+        (effective_weights,) = cached
+    else:
+        effective_weights = eligible_patterns.effective_weights(emotion_bias)
+        if distributions is not None:
+            distributions[key] = (effective_weights,)
+    return effective_weights, eligible_patterns.positions, eligible_patterns.sequence_ids
+
+
+def get_effective_weights(emotion_bias:dict[str, float] , pattern_index: PatternIndex, section_attributes:dict , exclude:frozenset[int], distributions:DistributionCache | None = None) -> tuple[np.ndarray, np.ndarray]:
+    # exclude holds sequence ids, so each excluded progression is one integer compare per pattern.
+    effective_weights, positions, sequence_ids = section_distribution(emotion_bias, pattern_index, section_attributes, distributions)
+
+    keep = effective_weights > 0
+    for sequence_id in exclude:
+        keep &= sequence_ids != sequence_id
+
+    return effective_weights[keep] , positions[keep]
+
+
+def section_sampler(emotion_bias:dict[str, float] , pattern_index: PatternIndex, section_attributes:dict , distributions:DistributionCache | None = None) -> tuple[np.ndarray, np.ndarray]:
+    # Running totals and positions of every candidate, for pick_cumulative. Exclusions are applied
+    # at draw time, so one entry serves whatever the previous sections happened to be.
+    key = (id(pattern_index), _constraint_key(section_attributes), tuple(emotion_bias.items()), "sampler")
+    cached = distributions.get(key) if distributions is not None else None
+    if cached is not None:
+        return cached
+    weights, candidates = get_effective_weights(emotion_bias, pattern_index, section_attributes, frozenset(), distributions)
+    sampler = (np.cumsum(weights), candidates)
+    if distributions is not None:
+        distributions[key] = sampler
+    return sampler
+
+
+def draw_section_pattern(emotion_bias:dict[str, float] , pattern_index: PatternIndex, section_attributes:dict , exclude:frozenset[int], distributions:DistributionCache | None = None, rng:random.Random | None = None) -> int | None:
+    # Position of a pattern drawn in proportion to its weight among the non-excluded candidates, or
+    # None if there are none. A draw that lands on an excluded pattern is redrawn, which keeps the
+    # same distribution; only when the excluded patterns carry most of the weight is the remaining
+    # set weighted afresh, and that one-off result is never cached.
+    cumulative, candidates = section_sampler(emotion_bias, pattern_index, section_attributes, distributions)
+    if not len(candidates) or cumulative[-1] == 0:
+        return None
+    for _ in range(MAX_EXCLUDED_REDRAWS):
+        position = int(candidates[pick_cumulative(cumulative, rng)])
+        if int(pattern_index.sequence_ids[position]) not in exclude:
+            return position
+    weights, candidates = get_effective_weights(emotion_bias, pattern_index, section_attributes, exclude, distributions)
+    if not len(candidates):
+        return None
+    return int(candidates[pick_cumulative(np.cumsum(weights), rng)])
+
+
+def prefill_section_distributions(prompt_emotion_biases:list[dict[str, float]] , pattern_index: PatternIndex, distributions:DistributionCache , section_config:dict = SECTION_CONFIG) -> None:
+    # Batched section_distribution: every section's adjusted biases for all prompts are weighted in
+    # one product over that section's eligible patterns, then stored under section_distribution's keys.
+    for section_attributes in section_config.values():
+        eligible_patterns = compile_section_constraints(pattern_index, section_attributes)
+        pending:dict[tuple, dict[str, float]] = {}
+        for prompt_emotion_bias in prompt_emotion_biases:
+            emotion_bias = section_emotion_bias(prompt_emotion_bias, section_attributes)
+            key = (id(pattern_index), _constraint_key(section_attributes), tuple(emotion_bias.items()))
+            if key not in distributions:
+                pending[key] = emotion_bias
+        if not pending:
+            continue
+        weight_rows = eligible_patterns.effective_weights_many(list(pending.values()))
+        for key, effective_weights in zip(pending, weight_rows):
+            distributions[key] = (effective_weights,)
+
+
+def section_emotion_bias(prompt_emotion_bias:dict , section_attributes:dict)->dict[str, float]:
     bias_delta:dict = section_attributes.get('bias_delta')
 
     emotion_bias = prompt_emotion_bias.copy()
@@ -196,44 +369,62 @@ def get_chord_prog(section_attributes:dict , prompt_emotion_bias:dict , progress
             if emotion in emotion_bias:
                 emotion_bias[emotion] = min(max(emotion_bias[emotion] + bias_delta[emotion] , 0.0 ), 1.0) # normalized updated bias
 
-    weights:list[float] = []
-    progression_patterns:list[ProgressionSummary] = [] 
+    return emotion_bias
+
+
+def get_chord_prog(section_attributes:dict , prompt_emotion_bias:dict , pattern_index: PatternIndex, exclude:frozenset[int], distributions:DistributionCache | None = None, rng:random.Random | None = None)->tuple[list[str], int]:
+   
+    emotion_bias = section_emotion_bias(prompt_emotion_bias, section_attributes)
+
+    position = draw_section_pattern(emotion_bias , pattern_index, section_attributes , exclude, distributions, rng)
+    if position is None:
+        position = draw_section_pattern(emotion_bias, pattern_index, {}, exclude, distributions, rng)
+    if position is None and exclude:
+        # Every pattern was excluded; repeating one beats failing.
+        position = draw_section_pattern(emotion_bias, pattern_index, {}, frozenset(), distributions, rng)
+    if position is None:
+        raise ValueError("no pattern has a positive weight for this section")
+    chosen_pattern:PatternRecord = pattern_index.patterns[position]
+
+    chords = [
+        (NUMERALS.names[roman_code], FUNCTIONS.names[function_code])
+        for roman_code, function_code in zip(chosen_pattern.roman_codes, chosen_pattern.function_codes)
+    ]
+    result:list[str] = choose_extensions(chords, emotion_bias, rng)
 
-    weights, progression_patterns = get_effective_weights(emotion_bias , progression_pattern_summary, section_attributes , exclude)
-    if not progression_patterns or not weights or sum(weights) == 0:
-        weights, progression_patterns = get_effective_weights(emotion_bias, progression_pattern_summary, {}, exclude)
 
-    chosen_progression_summary:ProgressionSummary = random.choices(progression_patterns, weights, k=1)[0]
+    
+    return result , int(pattern_index.sequence_ids[position])
 
-    result:list[str] = []
 
-    for i in range(len(chosen_progression_summary["function_sequence"])):
-        function_seq = chosen_progression_summary["function_sequence"][i]
-        roman_seq = chosen_progression_summary['roman_sequence'][i]
-        result.append(
-            choose_extension(
-                roman_seq=roman_seq,
-                function=function_seq,
-                mode=chosen_progression_summary.get("mode", "major"),
-                emotion_bias=emotion_bias,
-            )
-        )
 
 
-    
-    return result , chosen_progression_summary['roman_sequence']
+def section_plan(section_names:Iterable[str], section_config:dict = SECTION_CONFIG)->Iterator[tuple[str, dict]]:
+    # Named sections may repeat in any order and number (intro, verse, chorus, verse, ...);
+    # pairs are produced as they are consumed, so the plan can be a generator of any length.
+    for section_name in section_names:
+        yield section_name, section_config[section_name]
+
+
+def iter_sections(prompt_emotion_bias, pattern_index: PatternIndex, sections: dict | Iterable[tuple[str, dict]] = SECTION_CONFIG, distributions:DistributionCache | None = None, rng:random.Random | None = None, avoid_last:int = AVOID_LAST_SECTIONS)->Iterator[tuple[str, list[str]]]:
+    # Yields each section as soon as it is drawn. Only the last avoid_last sequence ids are kept,
+    # so memory stays flat however long the section list is.
+    previous_chord_progs:deque[int] = deque(maxlen=avoid_last)
+    for section_name, section_attributes in (sections.items() if isinstance(sections, dict) else sections):
+        chord_prog_with_extensions , chord_prog =  get_chord_prog(section_attributes,prompt_emotion_bias, pattern_index, frozenset(previous_chord_progs), distributions, rng)
+        previous_chord_progs.append(chord_prog)
+        yield section_name, chord_prog_with_extensions
 
 
+def generate_sections(prompt_emotion_bias, pattern_index: PatternIndex, section_config: dict = SECTION_CONFIG, distributions:DistributionCache | None = None, rng:random.Random | None = None, avoid_last:int = AVOID_LAST_SECTIONS)->list[tuple[str, list[str]]]:
+    return list(iter_sections(prompt_emotion_bias, pattern_index, section_config, distributions, rng, avoid_last))
 
 
-def get_all_section_progression(prompt_emotion_bias, progression_pattern_summary)->list[str]:
+def get_all_section_progression(prompt_emotion_bias, pattern_index: PatternIndex, rng:random.Random | None = None)->list[str]:
     sections_chord_prog:list[str] = []
-    previous_chord_prog:list[str] = []
-    for _, section_attributes in SECTION_CONFIG.items():
-        chord_prog_with_extensions , chord_prog =  get_chord_prog(section_attributes,prompt_emotion_bias, progression_pattern_summary, previous_chord_prog)
-        previous_chord_prog = chord_prog
+    for section_name, chord_prog_with_extensions in generate_sections(prompt_emotion_bias, pattern_index, rng=rng):
         sections_chord_prog.extend(chord_prog_with_extensions)
-        print("section: ", _)
+        print("section: ", section_name)
         print("chord progression: ", chord_prog_with_extensions)
 
 